@@ -1,4 +1,5 @@
 import tensorflow as tf
+import point_cloud_ops
 from math import pi
 
 def rotate_op(rot):
@@ -81,7 +82,8 @@ def sort_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter
     var = tf.Variable(x_adv, trainable = False, collections = ["not_in_checkpoint"])
     with tf.control_dependencies([tf.variables_initializer([var])]):
         for _ in range(iter):
-            _, loss = model_loss_fn(x_adv, t_pl)
+            logits, loss = model_loss_fn(x_adv, t_pl)
+            loss = attack_loss_op(logits, loss, t_pl, one_hot = one_hot)
             grad = tf.reduce_mean(tf.gradients(loss, x_adv)[0], axis = 2)
             #grad_sorted = tf.contrib.framework.argsort(grad, axis = 1)
             
@@ -106,23 +108,76 @@ def sort_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter
     
     return x_adv
 
-def iter_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, restrict = False, ord = "inf", clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0):
+def object_loss_op(logits, t, one_hot = True):
+    # the loss of each object on its own, unlike the mean loss of the models, so it does not depend on what else is in the batch
+    if one_hot:
+        return tf.nn.softmax_cross_entropy_with_logits(labels = t, logits = logits)
+    return tf.nn.sparse_softmax_cross_entropy_with_logits(labels = t, logits = logits)
+
+def attack_loss_op(logits, loss, t, one_hot = True):
+    # the model's loss averages the classification loss over the batch but sums its regularization, so their balance in each object's gradient would change with the batch size
+    # summing the classification losses instead gives every object the gradient that it would get in a batch of its own
+    object_loss = object_loss_op(logits, t, one_hot = one_hot)
+    return tf.reduce_sum(object_loss) + (loss - tf.reduce_mean(object_loss))
+
+def success_op(logits, t_pl, targeted, one_hot = True):
+    if one_hot:
+        labels = tf.argmax(t_pl, axis = 1)
+    else:
+        labels = tf.to_int64(t_pl)
+    preds = tf.argmax(logits, axis = 1)
+
+    if targeted:
+        return tf.equal(preds, labels)
+    else:
+        return tf.not_equal(preds, labels)
+
+def loop_op(step_fn, loop_vars, iter, loop = False, early_stop = False):
+    # step_fn returns the new loop variables and whether the attack already succeeded on each object before the step
+    # early stopping needs a graph-level loop, where iter and eps can be tensors and the model's variables must already exist
+    if not loop:
+        for _ in range(iter):
+            loop_vars, _ = step_fn(*loop_vars)
+        return loop_vars, None
+
+    def cond(i, done, iters, *loop_vars):
+        if early_stop:
+            # stop as soon as the attack succeeded on every object in the batch
+            return (i < iter) & ~tf.reduce_all(done)
+        return i < iter
+
+    def body(i, done, iters, *loop_vars):
+        new_loop_vars, succeeded = step_fn(*loop_vars)
+        if early_stop:
+            done = done | succeeded
+            # freeze the objects that the attack already succeeded on
+            new_loop_vars = [tf.where(done, var, new_var) for var, new_var in zip(loop_vars, new_loop_vars)]
+            iters = iters + tf.to_int32(~done)
+        else:
+            iters = iters + 1
+        # keep the static shapes so that the loop variables satisfy the shape invariants
+        for new_var, var in zip(new_loop_vars, loop_vars):
+            new_var.set_shape(var.shape)
+        return [i + 1, done, iters] + list(new_loop_vars)
+
+    batch_size = tf.shape(loop_vars[0])[0]
+    res = tf.while_loop(cond, body, [tf.constant(0), tf.fill([batch_size], False), tf.zeros([batch_size], dtype = tf.int32)] + list(loop_vars), back_prop = False)
+    return res[3:], res[2]
+
+def iter_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, restrict = False, ord = "inf", clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0, loop = False, early_stop = False):
     targeted = t_pl is not None
-    alpha = eps / float(iter)
+    loop = loop or early_stop
+    num_iter = tf.to_float(iter) if loop else float(iter)
+    alpha = eps / num_iter
     if clip_norm is not None:
-        dists = x_pl[:, tf.newaxis] - x_pl[:, :, tf.newaxis]
-        dists = tf.linalg.norm(dists, axis = 3)
-
-        diag = tf.eye(tf.shape(x_pl)[1], batch_shape = [tf.shape(x_pl)[0]])
-        dists = tf.where(diag > 0.0, tf.fill(tf.shape(dists), float("inf")), dists)
-        
-        dists = tf.reduce_min(dists, axis = 2)
+        dists = point_cloud_ops.knn_dists_op(x_pl, k = 1)
+        dists = dists[:, :, 0]
         avg, var = tf.nn.moments(dists, axes = [1], keep_dims = True)
         std = clip_norm * tf.sqrt(var)
         clip_norm = avg + std # set clip_norm to be the actual clip value
         
-        clip_norm = clip_norm / float(iter)
-    min_norm = min_norm / float(iter)
+        clip_norm = clip_norm / num_iter
+    min_norm = min_norm / num_iter
 
     # use the prediction class to prevent label leaking
     if not targeted:
@@ -131,6 +186,8 @@ def iter_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True,
         if one_hot:
             t_pl = tf.one_hot(t_pl, tf.shape(logits)[1])
         t_pl = tf.stop_gradient(t_pl)
+    elif loop:
+        model_loss_fn(x_pl, None)
 
     if faces is not None:
         normal = tf.cross(faces[:, :, 1] - faces[:, :, 0], faces[:, :, 2] - faces[:, :, 1])
@@ -149,9 +206,9 @@ def iter_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True,
     else:
         raise ValueError("Only L-inf, L1, L2, and normalized L2 norms are supported!")
 
-    x_adv = x_pl
-    for _ in range(iter):
-        _, loss = model_loss_fn(x_adv, t_pl)
+    def step(x_adv):
+        logits, loss = model_loss_fn(x_adv, t_pl)
+        loss = attack_loss_op(logits, loss, t_pl, one_hot = one_hot)
 
         x_original = x_adv
 
@@ -177,27 +234,28 @@ def iter_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True,
         if clip_min is not None and clip_max is not None:
             x_adv = tf.clip_by_value(x_adv, clip_min, clip_max)
         
-        x_adv = tf.stop_gradient(x_adv)
+        return [tf.stop_gradient(x_adv)], success_op(logits, t_pl, targeted, one_hot = one_hot)
     
+    (x_adv,), iters = loop_op(step, [x_pl], iter, loop = loop, early_stop = early_stop)
+    
+    if early_stop:
+        return x_adv, iters
     return x_adv
 
-def momentum_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, momentum = 1.0, restrict = False, ord = "inf", clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0):
+def momentum_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, momentum = 1.0, restrict = False, ord = "inf", clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0, loop = False, early_stop = False):
     targeted = t_pl is not None
-    alpha = eps / float(iter)
+    loop = loop or early_stop
+    num_iter = tf.to_float(iter) if loop else float(iter)
+    alpha = eps / num_iter
     if clip_norm is not None:
-        dists = x_pl[:, tf.newaxis] - x_pl[:, :, tf.newaxis]
-        dists = tf.linalg.norm(dists, axis = 3)
-
-        diag = tf.eye(tf.shape(x_pl)[1], batch_shape = [tf.shape(x_pl)[0]])
-        dists = tf.where(diag > 0.0, tf.fill(tf.shape(dists), float("inf")), dists)
-        
-        dists = tf.reduce_min(dists, axis = 2)
+        dists = point_cloud_ops.knn_dists_op(x_pl, k = 1)
+        dists = dists[:, :, 0]
         avg, var = tf.nn.moments(dists, axes = [1], keep_dims = True)
         std = clip_norm * tf.sqrt(var)
         clip_norm = avg + std # set clip_norm to be the actual clip value
 
-        clip_norm = clip_norm / float(iter)
-    min_norm = min_norm / float(iter)
+        clip_norm = clip_norm / num_iter
+    min_norm = min_norm / num_iter
 
     # use the prediction class to prevent label leaking
     if not targeted:
@@ -206,6 +264,8 @@ def momentum_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = T
         if one_hot:
             t_pl = tf.one_hot(t_pl, tf.shape(logits)[1])
         t_pl = tf.stop_gradient(t_pl)
+    elif loop:
+        model_loss_fn(x_pl, None)
 
     if faces is not None:
         normal = tf.cross(faces[:, :, 1] - faces[:, :, 0], faces[:, :, 2] - faces[:, :, 1])
@@ -224,15 +284,13 @@ def momentum_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = T
     else:
         raise ValueError("Only L-inf, L1, L2, and normalized L2 norms are supported!")
 
-    x_adv = x_pl
-    prev_grad = tf.zeros_like(x_pl)
-    for _ in range(iter):
-        _, loss = model_loss_fn(x_adv, t_pl)
+    def step(x_adv, prev_grad):
+        logits, loss = model_loss_fn(x_adv, t_pl)
+        loss = attack_loss_op(logits, loss, t_pl, one_hot = one_hot)
 
         grad = tf.gradients(loss, x_adv)[0]
         grad = grad / tf.reduce_mean(tf.abs(grad), axis = list(range(1, x_pl.shape.ndims)), keep_dims = True)
         grad = momentum * prev_grad + grad
-        prev_grad = grad
 
         x_original = x_adv
 
@@ -258,18 +316,25 @@ def momentum_grad_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = T
         if clip_min is not None and clip_max is not None:
             x_adv = tf.clip_by_value(x_adv, clip_min, clip_max)
         
-        x_adv = tf.stop_gradient(x_adv)
+        return [tf.stop_gradient(x_adv), grad], success_op(logits, t_pl, targeted, one_hot = one_hot)
     
+    (x_adv, _), iters = loop_op(step, [x_pl, tf.zeros_like(x_pl)], iter, loop = loop, early_stop = early_stop)
+    
+    if early_stop:
+        return x_adv, iters
     return x_adv
 
-def jacobian_saliency_map_points_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, restrict = False, clip_min = None, clip_max = None):
+def jacobian_saliency_map_points_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, restrict = False, clip_min = None, clip_max = None, loop = False, early_stop = False):
     targeted = t_pl is not None
+    loop = loop or early_stop
     
     # use the prediction class to prevent label leaking
     if not targeted:
         logits, _ = model_loss_fn(x_pl, None)
         t_pl = tf.argmax(logits, axis = 1)
         t_pl = tf.stop_gradient(t_pl)
+    elif loop:
+        model_loss_fn(x_pl, None)
     
     if targeted and one_hot:
         t_pl = tf.argmax(t_pl, axis = 1)
@@ -279,9 +344,7 @@ def jacobian_saliency_map_points_op(x_pl, model_loss_fn, t_pl = None, faces = No
         normal = tf.cross(faces[:, :, 1] - faces[:, :, 0], faces[:, :, 2] - faces[:, :, 1])
         normal = normal / tf.linalg.norm(normal, axis = 2, keep_dims = True)
 
-    x_adv = x_pl
-    unused = tf.fill(tf.shape(x_adv)[:2], True)
-    for _ in range(iter):
+    def step(x_adv, unused):
         logits, _ = model_loss_fn(x_adv, None)
 
         total_grad = tf.gradients(logits, x_adv)[0]
@@ -302,7 +365,7 @@ def jacobian_saliency_map_points_op(x_pl, model_loss_fn, t_pl = None, faces = No
 
         x_original = x_adv
 
-        perturb = tf.to_float(increase) * tf.fill(tf.shape(x_adv), -eps) + tf.to_float(decrease) * tf.fill(tf.shape(x_adv), eps)
+        perturb = tf.to_float(increase) * (-eps * tf.ones_like(x_adv)) + tf.to_float(decrease) * (eps * tf.ones_like(x_adv))
 
         if targeted:
             x_adv = x_adv - perturb
@@ -319,18 +382,90 @@ def jacobian_saliency_map_points_op(x_pl, model_loss_fn, t_pl = None, faces = No
         if clip_min is not None and clip_max is not None:
             x_adv = tf.clip_by_value(x_adv, clip_min, clip_max)
 
-        x_adv = tf.stop_gradient(x_adv)
+        return [tf.stop_gradient(x_adv), unused], success_op(logits, t_pl, targeted, one_hot = False)
     
+    (x_adv, _), iters = loop_op(step, [x_pl, tf.fill(tf.shape(x_pl)[:2], True)], iter, loop = loop, early_stop = early_stop)
+    
+    if early_stop:
+        return x_adv, iters
     return x_adv
 
-def jacobian_saliency_map_pair_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, restrict = False, clip_min = None, clip_max = None):
+def saliency_pair_op(saliency, target_grad, other_grad, unused, targeted, block_size = 64):
+    # finds the same pair as an argmax over the whole size x size pair saliency matrix without building it
+    # pairs are searched in blocks of block_size rows, in order of decreasing saliency, until no other pair can be better
+    batch_size = tf.shape(saliency)[0]
+    size = tf.shape(saliency)[1]
+    num_blocks = (size + block_size - 1) // block_size
+
+    # saliency is never negative, so -1 marks used coordinates
+    sorted_saliency, order = tf.nn.top_k(tf.where(unused, saliency, -tf.ones_like(saliency)), k = size)
+    sorted_saliency = tf.pad(sorted_saliency, [[0, 0], [0, num_blocks * block_size + 1 - size]], constant_values = -1.0)
+    order = tf.pad(order, [[0, 0], [0, num_blocks * block_size - size]])
+
+    cols = tf.range(size)
+    batch_idx = tf.tile(tf.range(batch_size)[:, tf.newaxis], [1, block_size])
+
+    def bound_op(b):
+        # the most salient pair that has not been searched yet
+        return sorted_saliency[:, b * block_size] + sorted_saliency[:, b * block_size + 1]
+
+    def cond(b, best, best_key):
+        bound = bound_op(b)
+        # keep searching on ties, since the exhaustive version picks the first pair
+        search = (bound > best) | (tf.equal(bound, best) & (best > 0.0))
+        return (b < num_blocks) & tf.reduce_any(search)
+
+    def body(b, best, best_key):
+        rows = order[:, b * block_size:(b + 1) * block_size]
+        rows_used = sorted_saliency[:, b * block_size:(b + 1) * block_size] < 0.0
+        gather_idx = tf.stack([batch_idx, rows], axis = 2)
+
+        pair_target_grad = tf.gather_nd(target_grad, gather_idx)[:, :, tf.newaxis] + target_grad[:, tf.newaxis, :]
+        pair_other_grad = tf.gather_nd(other_grad, gather_idx)[:, :, tf.newaxis] + other_grad[:, tf.newaxis, :]
+        pair_saliency = tf.gather_nd(saliency, gather_idx)[:, :, tf.newaxis] + saliency[:, tf.newaxis, :]
+
+        if targeted:
+            # target should increase, others should decrease
+            valid = (pair_target_grad >= 0.0) & (pair_other_grad <= 0.0)
+        else:
+            # others should increase, target should decrease
+            valid = (pair_target_grad <= 0.0) & (pair_other_grad >= 0.0)
+        valid = valid & ~rows_used[:, :, tf.newaxis] & unused[:, tf.newaxis, :] & tf.not_equal(rows[:, :, tf.newaxis], cols[tf.newaxis, tf.newaxis, :])
+        pair_saliency = tf.where(valid, pair_saliency, tf.zeros_like(pair_saliency))
+
+        # break ties by the position of the pair in the flattened matrix
+        lo = tf.to_int64(tf.minimum(rows[:, :, tf.newaxis], cols[tf.newaxis, tf.newaxis, :]))
+        hi = tf.to_int64(tf.maximum(rows[:, :, tf.newaxis], cols[tf.newaxis, tf.newaxis, :]))
+        key = lo * tf.to_int64(size) + hi
+
+        block_best = tf.reduce_max(pair_saliency, axis = [1, 2])
+        is_best = tf.equal(pair_saliency, block_best[:, tf.newaxis, tf.newaxis])
+        block_key = tf.reduce_min(tf.where(is_best, key, tf.fill(tf.shape(key), tf.to_int64(size) * tf.to_int64(size))), axis = [1, 2])
+
+        best_key = tf.where(block_best > best, block_key, tf.where(tf.equal(block_best, best), tf.minimum(best_key, block_key), best_key))
+        best = tf.maximum(best, block_best)
+
+        return [b + 1, best, best_key]
+
+    # without a pair that has a positive saliency, the first entry of the matrix is picked
+    _, _, best_key = tf.while_loop(cond, body, [tf.constant(0), tf.zeros([batch_size]), tf.zeros([batch_size], dtype = tf.int64)], back_prop = False)
+
+    i = best_key // tf.to_int64(size)
+    j = best_key % tf.to_int64(size)
+
+    return i, j
+
+def jacobian_saliency_map_pair_op(x_pl, model_loss_fn, t_pl = None, faces = None, one_hot = True, iter = 10, eps = 0.01, restrict = False, clip_min = None, clip_max = None, loop = False, early_stop = False, block_size = 64):
     targeted = t_pl is not None
+    loop = loop or early_stop
     
     # use the prediction class to prevent label leaking
     if not targeted:
         logits, _ = model_loss_fn(x_pl, None)
         t_pl = tf.argmax(logits, axis = 1)
         t_pl = tf.stop_gradient(t_pl)
+    elif loop:
+        model_loss_fn(x_pl, None)
     
     if targeted and one_hot:
         t_pl = tf.argmax(t_pl, axis = 1)
@@ -340,10 +475,9 @@ def jacobian_saliency_map_pair_op(x_pl, model_loss_fn, t_pl = None, faces = None
         normal = tf.cross(faces[:, :, 1] - faces[:, :, 0], faces[:, :, 2] - faces[:, :, 1])
         normal = normal / tf.linalg.norm(normal, axis = 2, keep_dims = True)
 
-    x_adv = x_pl
-    size = tf.reduce_prod(tf.shape(x_adv)[1:])
-    unused = tf.fill([tf.shape(x_adv)[0], size], True)
-    for _ in range(iter):
+    size = tf.reduce_prod(tf.shape(x_pl)[1:])
+
+    def step(x_adv, unused):
         logits, _ = model_loss_fn(x_adv, None)
 
         total_grad = tf.gradients(logits, x_adv)[0]
@@ -352,27 +486,12 @@ def jacobian_saliency_map_pair_op(x_pl, model_loss_fn, t_pl = None, faces = None
 
         saliency = tf.abs(target_grad) * tf.abs(other_grad)
         saliency = tf.reshape(saliency, [-1, size])
-        saliency = saliency[:, tf.newaxis, :] + saliency[:, :, tf.newaxis]
         target_grad = tf.reshape(target_grad, [-1, size])
         other_grad = tf.reshape(other_grad, [-1, size])
-        target_grad = target_grad[:, tf.newaxis, :] + target_grad[:, :, tf.newaxis]
-        other_grad = other_grad[:, tf.newaxis, :] + other_grad[:, :, tf.newaxis]
 
-        if targeted:
-            # target should increase, others should decrease
-            cond = unused[:, tf.newaxis, :] & unused[:, :, tf.newaxis] & (target_grad >= 0.0) & (other_grad <= 0.0)
-        else:
-            # others should increase, target should decrease
-            cond = unused[:, tf.newaxis, :] & unused[:, :, tf.newaxis] & (target_grad <= 0.0) & (other_grad >= 0.0)
-
-        diag_zeros = tf.ones([size, size])
-        diag_zeros = tf.linalg.set_diag(diag_zeros, tf.zeros(size))
-
-        idx_both = tf.argmax(tf.reshape(tf.to_float(cond) * diag_zeros[tf.newaxis, :, :] * saliency, [-1, size * size]), axis = 1)
-        i = tf.to_int64(idx_both / tf.to_int64(size))
-        j = tf.to_int64(idx_both % tf.to_int64(size))
-        perturb = tf.one_hot(i, size, on_value = eps, off_value = 0.0) + tf.one_hot(j, size, on_value = eps, off_value = 0.0)
-        perturb = tf.reshape(perturb, tf.shape(x_adv))
+        i, j = saliency_pair_op(saliency, target_grad, other_grad, unused, targeted, block_size = block_size)
+        perturb = tf.one_hot(i, size) + tf.one_hot(j, size)
+        perturb = tf.reshape(perturb, tf.shape(x_adv)) * eps
         unused = unused & tf.one_hot(i, size, on_value = False, off_value = True) & tf.one_hot(j, size, on_value = False, off_value = True)
 
         x_original = x_adv
@@ -388,8 +507,12 @@ def jacobian_saliency_map_pair_op(x_pl, model_loss_fn, t_pl = None, faces = None
         if clip_min is not None and clip_max is not None:
             x_adv = tf.clip_by_value(x_adv, clip_min, clip_max)
 
-        x_adv = tf.stop_gradient(x_adv)
+        return [tf.stop_gradient(x_adv), unused], success_op(logits, t_pl, targeted, one_hot = False)
+    
+    (x_adv, _), iters = loop_op(step, [x_pl, tf.fill([tf.shape(x_pl)[0], size], True)], iter, loop = loop, early_stop = early_stop)
     
+    if early_stop:
+        return x_adv, iters
     return x_adv
 
 inf = float("inf")
@@ -1,13 +1,8 @@
 import tensorflow as tf
+import point_cloud_ops
 
-def remove_outliers_fn(x, model_loss_fn, top_k = 10, num_std = 1.0):
-    dists = x[:, tf.newaxis] - x[:, :, tf.newaxis]
-    dists = tf.linalg.norm(dists, axis = 3)
-    
-    diag = tf.eye(tf.shape(x)[1], batch_shape = [tf.shape(x)[0]])
-    dists = tf.where(diag > 0.0, tf.fill(tf.shape(dists), float("inf")), dists)
-    dists = tf.nn.top_k(dists * -1.0, k = top_k, sorted = False)[0] * -1.0
-    
+def remove_outliers_fn(x, model_loss_fn, top_k = 10, num_std = 1.0, chunk_size = 256):
+    dists = point_cloud_ops.knn_dists_op(x, k = top_k, chunk_size = chunk_size)
     dists = tf.reduce_mean(dists, axis = 2)
     avg, var = tf.nn.moments(dists, axes = [1], keep_dims = True)
     std = num_std * tf.sqrt(var)
@@ -20,11 +15,24 @@ def remove_outliers_fn(x, model_loss_fn, top_k = 10, num_std = 1.0):
 
     return tf.stop_gradient(x)
 
-def remove_salient_points_fn(x, model_loss_fn, top_k = 100):
+def remove_salient_points_fn(x, model_loss_fn, top_k = 100, num_classes = None, use_loss = False):
     logits, _ = model_loss_fn(x, None)
     grads = []
-    for i in range(logits.shape[1]):
-        grads.append(tf.gradients(logits[:, i], x)[0])
+    if use_loss:
+        # a single backward pass through the loss of the predicted class
+        preds = tf.stop_gradient(tf.argmax(logits, axis = 1))
+        loss = tf.nn.sparse_softmax_cross_entropy_with_logits(labels = preds, logits = logits)
+        grads.append(tf.gradients(loss, x)[0])
+    elif num_classes is None:
+        for i in range(logits.shape[1]):
+            grads.append(tf.gradients(logits[:, i], x)[0])
+    else:
+        # only differentiate the num_classes most likely classes of each object
+        _, classes = tf.nn.top_k(logits, k = num_classes)
+        classes = tf.stop_gradient(classes)
+        for i in range(num_classes):
+            class_logits = tf.reduce_sum(logits * tf.one_hot(classes[:, i], tf.shape(logits)[1]), axis = 1)
+            grads.append(tf.gradients(class_logits, x)[0])
     grads = tf.stack(grads, axis = 0)
 
     norms = tf.linalg.norm(grads, axis = 3)
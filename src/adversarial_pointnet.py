@@ -2,11 +2,14 @@ import numpy as np
 import tensorflow as tf
 import scipy
 import adversarial_utils
+import point_cloud_dataset
+import frozen_graph
 import adversarial_defenses
 import os
 import sys
 import argparse
 import importlib
+import functools
 working_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(working_dir, "models"))
 sys.path.append(os.path.join(working_dir, "utils"))
@@ -14,33 +17,63 @@ import provider
 import pc_util
 
 parser = argparse.ArgumentParser(description = "Adversarial attacks on PointNet used for classification.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("--checkpoint", default = "log/model.ckpt", help = "Path to the model's checkpoint file.")
+parser.add_argument("--checkpoint", default = "log/model.ckpt", help = "Path to the model's checkpoint file, or a frozen graph from export_frozen_graph.py. A frozen graph only supports the batch size that it was exported with.")
 parser.add_argument("--output", default = "adversarial", help = "Output directory.")
-parser.add_argument("--data", default = "data/modelnet40_ply_hdf5_2048/test_files.txt", help = "Input data. Either a Numpy file or a text file containing a list of HDF5 files.")
+parser.add_argument("--data", default = "data/modelnet40_ply_hdf5_2048/test_files.txt", help = "Input data. Either a Numpy file, a dataset directory, or a text file containing a list of HDF5 files.")
 parser.add_argument("--class-names", default = "data/modelnet40_ply_hdf5_2048/shape_names.txt", help = "Text file containing a list of class names.")
 parser.add_argument("--num-points", type = int, default = 1024, help = "Number of points to use.")
 parser.add_argument("--num-objects", type = int, default = 1000000000, help = "Number of correctly classified objects to use. Specify a very large number to use all correctly classified objects.")
 parser.add_argument("--targeted", action = "store_true", help = "Run targeted attack.")
+parser.add_argument("--vectorize-targets", action = "store_true", help = "Attack every target class at once by tiling each object across all targets. Only used for targeted attacks.")
 parser.add_argument("--iter", type = int, default = 10, help = "Number of iterations for iterative gradient sign.")
+parser.add_argument("--graph-loop", action = "store_true", help = "Run the iterations of the iterative, momentum, saliency, and saliency_pair modes in a graph-level loop, so graph size does not grow with the number of iterations.")
+parser.add_argument("--early-stop", action = "store_true", help = "Stop attacking each object as soon as the attack succeeds on it, and stop the loop once it succeeds on the whole batch. Implies --graph-loop.")
+parser.add_argument("--resume", action = "store_true", help = "Resume an interrupted targeted attack run in the same output directory, skipping the batches that already finished.")
 parser.add_argument("--eps", nargs = "+", type = float, default = [1], help = "List of epsilon values for iterative gradient sign.")
-parser.add_argument("--mode", choices = ["iterative", "momentum", "saliency", "sort", "view"], default = "iterative", help = "Which algorithm to use when perturbing points.")
+parser.add_argument("--sweep-eps", action = "store_true", help = "Attack with every epsilon value in a single pass by stacking them on the batch axis. Only used for untargeted attacks.")
+parser.add_argument("--mode", choices = ["iterative", "momentum", "saliency", "saliency_pair", "sort", "view"], default = "iterative", help = "Which algorithm to use when perturbing points.")
 parser.add_argument("--defense", choices = ["none", "outliers", "saliency"], default = "none", help = "Which algorithm to use for postprocessing points as a defense.")
+parser.add_argument("--saliency-classes", type = int, default = None, help = "Only differentiate this many of the most likely classes in the saliency defense. Uses every class if not specified.")
+parser.add_argument("--saliency-loss", action = "store_true", help = "Use the gradient of the loss for the predicted class in the saliency defense, which only needs a single backward pass.")
 parser.add_argument("--projection", action = "store_true", help = "Project the gradient vectors onto each point's corresponding triangle.")
 parser.add_argument("--restrict", action = "store_true", help = "Restrict the gradient vectors to be inside each point's corresponding triangle.")
 parser.add_argument("--norm", default = "inf", help = "Norm used for gradient sign.")
 parser.add_argument("--clip-norm", type = float, default = None, help = "Value to clip L2 norm by.")
 parser.add_argument("--min-norm", type = float, default = 0.0, help = "Ignore perturbations with a smaller L2 norm than this.")
+parser.add_argument("--batch-size", type = int, default = 1, help = "Number of objects to attack and evaluate at once.")
+parser.add_argument("--clean-cache", default = None, help = "Directory for caching clean predictions between runs. Disabled if not specified.")
+parser.add_argument("--clean-only", action = "store_true", help = "Only compute the clean predictions and save them to the --clean-cache directory, without attacking. Used by parallel_attack.py to run the clean pass once for all workers.")
+parser.add_argument("--worker", type = int, default = 0, help = "Index of this worker process when the correct objects are split across processes by parallel_attack.py.")
+parser.add_argument("--num-workers", type = int, default = 1, help = "Number of worker processes that the correct objects are split across.")
+parser.add_argument("--intra-op-threads", type = int, default = 0, help = "Number of threads used within each TensorFlow op. Uses the TensorFlow default if 0.")
+parser.add_argument("--inter-op-threads", type = int, default = 0, help = "Number of TensorFlow ops run at once. Uses the TensorFlow default if 0.")
 args = parser.parse_args()
 print(args)
 
 model = importlib.import_module("pointnet_cls")
 class_names = [line.rstrip() for line in open(args.class_names)]
 
+if args.checkpoint.endswith(".pb"):
+    if args.vectorize_targets:
+        raise ValueError("Frozen graphs do not support vectorized targets, since tiling the objects changes the batch size!")
+    # loaded before the data, so a batch size that the frozen graph was not exported with fails early
+    model_loss_fn = frozen_graph.load_model_loss_fn(args.checkpoint, args.batch_size, model.get_loss)
+
 np.random.seed(0) # fixed seed for consistency
 
 numpy_file = args.data.endswith(".npz")
 
-if numpy_file:
+if point_cloud_dataset.is_dataset(args.data):
+    # memory mapped, so slicing does not load or copy the whole dataset
+    dataset = point_cloud_dataset.read_dataset(args.data)
+    data_x = dataset["points"][:, :args.num_points, :]
+    if args.projection:
+        data_f = dataset["faces"][:, :args.num_points, :3, :]
+    else:
+        data_f = None
+    data_t = dataset["labels"]
+    data_ids = dataset.get("ids")
+elif numpy_file:
     with np.load(args.data) as file:
         data_x = file["points"][:, :args.num_points, :]
         if args.projection:
@@ -48,6 +81,7 @@ if numpy_file:
         else:
             data_f = None
         data_t = file["labels"]
+        data_ids = file["ids"] if "ids" in file else None
 else:
     test_files = provider.getDataFiles(args.data)
 
@@ -61,65 +95,78 @@ else:
     data_x = np.concatenate(data_x)
     data_f = None
     data_t = np.concatenate(data_t)
+    data_ids = None
 
 defense_dict = {
     "none": None,
     "outliers": adversarial_defenses.remove_outliers_fn,
-    "saliency": adversarial_defenses.remove_salient_points_fn
+    "saliency": functools.partial(adversarial_defenses.remove_salient_points_fn, num_classes = args.saliency_classes, use_loss = args.saliency_loss)
 }
 
-x_pl, t_pl = model.placeholder_inputs(1, args.num_points)
+x_pl, t_pl = model.placeholder_inputs(args.batch_size, args.num_points)
 
 is_training = tf.placeholder(tf.bool, shape = [])
 
-def model_loss_fn(x, t):
-    with tf.variable_scope(tf.get_variable_scope(), reuse = tf.AUTO_REUSE):
-        y, end_points = model.get_model(x, is_training, num_classes = len(class_names))
-    if t is None:
-        loss = None
-    else:
-        loss = model.get_loss(y, t, end_points)
-    return y, loss
+if not args.checkpoint.endswith(".pb"):
+    def model_loss_fn(x, t):
+        with tf.variable_scope(tf.get_variable_scope(), reuse = tf.AUTO_REUSE):
+            y, end_points = model.get_model(x, is_training, num_classes = len(class_names))
+        if t is None:
+            loss = None
+        else:
+            loss = model.get_loss(y, t, end_points)
+        return y, loss
 
-if args.targeted:
-    res = adversarial_utils.targeted_attack(args.checkpoint, args.output, x_pl, t_pl, model_loss_fn, data_x, data_t, args.num_objects, class_names, data_f = data_f, restrict = args.restrict, iter = args.iter, eps_list = args.eps, norm = args.norm, mode = args.mode, one_hot = False, clip_norm = args.clip_norm, min_norm = args.min_norm, postprocess_fn = defense_dict[args.defense], extra_feed_dict = {is_training: False})
-    if data_f is None:
-        x_original, target, x_adv = res
-    else:
-        x_original, target, x_adv, faces = res
+if args.clean_only:
+    if args.clean_cache is None:
+        raise ValueError("Computing only the clean predictions requires a clean cache directory!")
+    adversarial_utils.cache_clean_predictions(args.checkpoint, x_pl, t_pl, model_loss_fn, data_x, data_t, args.clean_cache, one_hot = False, postprocess_fn = defense_dict[args.defense], extra_feed_dict = {is_training: False}, batch_size = args.batch_size)
+elif args.targeted:
+    res = adversarial_utils.targeted_attack(args.checkpoint, args.output, x_pl, t_pl, model_loss_fn, data_x, data_t, args.num_objects, class_names, data_f = data_f, restrict = args.restrict, iter = args.iter, eps_list = args.eps, norm = args.norm, mode = args.mode, one_hot = False, clip_norm = args.clip_norm, min_norm = args.min_norm, postprocess_fn = defense_dict[args.defense], extra_feed_dict = {is_training: False}, batch_size = args.batch_size, clean_cache_dir = args.clean_cache, loop = args.graph_loop, early_stop = args.early_stop, vectorize_targets = args.vectorize_targets, resume = args.resume, data_ids = data_ids, worker = args.worker, num_workers = args.num_workers, intra_op_threads = args.intra_op_threads, inter_op_threads = args.inter_op_threads)
 
     for eps_idx in range(len(args.eps)):
         class_idx = np.random.choice(len(class_names), size = len(class_names), replace = False)
         for i in class_idx:
-            idx = np.random.choice(len(x_original[eps_idx][i]), size = min(3, len(x_original[eps_idx][i])), replace = False)
-            for j in idx:
-                img_file = "%d_%s_original.jpg" % (j, class_names[target[eps_idx][i][j]])
+            with np.load(res[eps_idx][i]) as file:
+                x_original = file["x_original"]
+                target = file["labels"]
+                x_adv = file["x_adv"]
+
+            idx = np.random.choice(len(x_original), size = min(3, len(x_original)), replace = False)
+            # render the original and adversarial point clouds at once
+            imgs = pc_util.point_cloud_three_views_batch(list(x_original[idx]) + list(x_adv[idx]))
+            for k, j in enumerate(idx):
+                img_file = "%d_%s_original.jpg" % (j, class_names[target[j]])
                 img_file = os.path.join(args.output, img_file)
-                img = pc_util.point_cloud_three_views(x_original[eps_idx][i][j])
+                img = imgs[k]
                 scipy.misc.imsave(img_file, img)
 
                 eps_str = str(args.eps[eps_idx]).replace(".", "_")
-                img_file = "%d_%s_adv_target_%s_eps_%s.jpg" % (j, class_names[target[eps_idx][i][j]], class_names[i], eps_str)
+                img_file = "%d_%s_adv_target_%s_eps_%s.jpg" % (j, class_names[target[j]], class_names[i], eps_str)
                 img_file = os.path.join(args.output, img_file)
-                img = pc_util.point_cloud_three_views(x_adv[eps_idx][i][j])
+                img = imgs[len(idx) + k]
                 scipy.misc.imsave(img_file, img)
 else:
-    res = adversarial_utils.untargeted_attack(args.checkpoint, args.output, x_pl, t_pl, model_loss_fn, data_x, data_t, args.num_objects, class_names, data_f = data_f, restrict = args.restrict, iter = args.iter, eps_list = args.eps, norm = args.norm, mode = args.mode, one_hot = False, clip_norm = args.clip_norm, min_norm = args.min_norm, postprocess_fn = defense_dict[args.defense], extra_feed_dict = {is_training: False})
-    if data_f is None:
-        x_original, target, x_adv, pred_adv = res
-    else:
-        x_original, target, x_adv, pred_adv, faces = res
+    res = adversarial_utils.untargeted_attack(args.checkpoint, args.output, x_pl, t_pl, model_loss_fn, data_x, data_t, args.num_objects, class_names, data_f = data_f, restrict = args.restrict, iter = args.iter, eps_list = args.eps, norm = args.norm, mode = args.mode, one_hot = False, clip_norm = args.clip_norm, min_norm = args.min_norm, postprocess_fn = defense_dict[args.defense], extra_feed_dict = {is_training: False}, batch_size = args.batch_size, clean_cache_dir = args.clean_cache, loop = args.graph_loop, early_stop = args.early_stop, sweep_eps = args.sweep_eps, data_ids = data_ids, worker = args.worker, num_workers = args.num_workers, intra_op_threads = args.intra_op_threads, inter_op_threads = args.inter_op_threads)
 
     for eps_idx in range(len(args.eps)):
-        idx = np.random.choice(len(x_original[eps_idx]), size = min(3, len(x_original[eps_idx])), replace = False)
-        for i in idx:
-            img_file = "%d_%s_original.jpg" % (i, class_names[target[eps_idx][i]])
+        with np.load(res[eps_idx]) as file:
+            x_original = file["x_original"]
+            target = file["labels"]
+            x_adv = file["x_adv"]
+            pred_adv = file["pred_adv"]
+
+        idx = np.random.choice(len(x_original), size = min(3, len(x_original)), replace = False)
+        # render the original and adversarial point clouds at once
+        imgs = pc_util.point_cloud_three_views_batch(list(x_original[idx]) + list(x_adv[idx]))
+        for k, i in enumerate(idx):
+            img_file = "%d_%s_original.jpg" % (i, class_names[target[i]])
             img_file = os.path.join(args.output, img_file)
-            img = pc_util.point_cloud_three_views(x_original[eps_idx][i])
+            img = imgs[k]
             scipy.misc.imsave(img_file, img)
 
             eps_str = str(args.eps[eps_idx]).replace(".", "_")
-            img_file = "%d_%s_adv_pred_%s_eps_%s.jpg" % (i, class_names[target[eps_idx][i]], class_names[pred_adv[eps_idx][i]], eps_str)
+            img_file = "%d_%s_adv_pred_%s_eps_%s.jpg" % (i, class_names[target[i]], class_names[pred_adv[i]], eps_str)
             img_file = os.path.join(args.output, img_file)
-            img = pc_util.point_cloud_three_views(x_adv[eps_idx][i])
+            img = imgs[len(idx) + k]
             scipy.misc.imsave(img_file, img)
\ No newline at end of file
@@ -5,8 +5,14 @@ matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
 import adversarial_attacks
+import result_writer
 import os
 import errno
+import glob
+import hashlib
+import functools
+import json
+import time
 
 np.random.seed(0) # fixed seed for consistency
 
@@ -76,7 +82,318 @@ def heatmap(data, path, x_label, y_label, class_names = None, percentages = True
     plt.savefig(path)
     plt.close()
 
-def untargeted_attack(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data_t, num_objects, class_names, iter, eps_list, norm = "inf", data_f = None, restrict = False, one_hot = True, mode = "iterative", momentum = 1.0, clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0, postprocess_fn = None, extra_feed_dict = None):
+def iterate_batches(sess, ops, batch_feed_dict, batch_size, feed_dict = None, skip = None):
+    num = len(next(iter(batch_feed_dict.values())))
+
+    for start in range(0, num, batch_size):
+        if skip is not None and start in skip:
+            continue
+        end = min(start + batch_size, num)
+        curr_feed_dict = {}
+        for pl, data in batch_feed_dict.items():
+            batch = data[start:end]
+            if len(batch) < batch_size:
+                # pad the last batch by repeating its last object, since the placeholders have a fixed batch size
+                batch = np.concatenate([batch, np.repeat(batch[-1:], batch_size - len(batch), axis = 0)])
+            curr_feed_dict[pl] = batch
+        if feed_dict is not None:
+            curr_feed_dict.update(feed_dict)
+        
+        outputs = []
+        for output in sess.run(ops, feed_dict = curr_feed_dict):
+            outputs.append(np.asarray(output)[:end - start])
+        
+        yield start, end, outputs
+
+class IndexedArray(object):
+    # data[idx], gathered one batch at a time by iterate_batches instead of all at once
+    def __init__(self, data, idx):
+        self.data = data
+        self.idx = idx
+
+    def __len__(self):
+        return len(self.idx)
+
+    def __getitem__(self, k):
+        return self.data[self.idx[k]]
+
+def run_batches(sess, ops, batch_feed_dict, batch_size, feed_dict = None):
+    res = [[] for _ in ops]
+    for _, _, outputs in iterate_batches(sess, ops, batch_feed_dict, batch_size, feed_dict = feed_dict):
+        for curr_res, output in zip(res, outputs):
+            curr_res.append(output)
+    
+    return [np.concatenate(curr_res) for curr_res in res]
+
+def score_batches(sess, ops, logits_op, probs_op, x_pl, batch_feed_dict, batch_size, feed_dict = None, extra_feed_dict = None, skip = None):
+    # runs the attack and scores its adversarial examples one batch at a time, so only one batch of them is in memory
+    for start, end, outputs in iterate_batches(sess, ops, batch_feed_dict, batch_size, feed_dict = feed_dict, skip = skip):
+        logits_adv, probs_adv = run_batches(sess, [logits_op, probs_op], {x_pl: outputs[0]}, batch_size, feed_dict = extra_feed_dict)
+        yield start, end, outputs, np.argmax(logits_adv, axis = 1), probs_adv
+
+def empty_results(data_x, data_t, data_ids, data_f = None, pred_adv = False):
+    # the arrays of a results file that no objects succeeded in, so it has the same arrays as any other results file
+    arrays = {
+        "x_original": data_x[:0],
+        "labels": data_t[:0],
+        "x_adv": np.zeros(shape = (0,) + data_x.shape[1:], dtype = np.float32)
+    }
+    if data_ids is not None:
+        arrays["ids"] = data_ids[:0]
+    if pred_adv:
+        arrays["pred_adv"] = np.zeros(shape = 0, dtype = int)
+    if data_f is not None:
+        arrays["faces"] = data_f[:0]
+    return arrays
+
+def tile_op(x, multiples):
+    # repeats each object in the batch, keeping copies of the same object next to each other
+    x_tiled = tf.tile(x[:, tf.newaxis], [1, multiples] + [1] * (x.shape.ndims - 1))
+    if x.shape[1:].is_fully_defined():
+        shape = [x.shape[0].value * multiples] + x.shape.as_list()[1:]
+    else:
+        shape = tf.concat([[tf.shape(x)[0] * multiples], tf.shape(x)[1:]], axis = 0)
+    return tf.reshape(x_tiled, shape)
+
+# the per object losses are cached under a different name than the mean losses that older caches held
+clean_cache_names = ["logits", "object_losses", "probs"]
+
+def checkpoint_hash(model_path):
+    if os.path.isfile(model_path):
+        paths = [model_path]
+    else:
+        # the graph in the .meta file does not affect the predictions
+        paths = sorted(path for path in glob.glob(model_path + ".*") if not path.endswith(".meta"))
+    if len(paths) == 0:
+        raise ValueError("Checkpoint %s does not exist!" % model_path)
+
+    res = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                res.update(chunk)
+    return res.hexdigest()
+
+def restore_model(sess, model_path):
+    # frozen graphs have their weights baked in as constants, so only checkpoints need to be restored
+    if not model_path.endswith(".pb"):
+        tf.train.Saver().restore(sess, model_path)
+
+def data_hash(*arrays):
+    res = hashlib.sha1()
+    for arr in arrays:
+        res.update(("%s %s" % (arr.dtype.str, arr.shape)).encode())
+        # hash a few objects at a time, so memory mapped data is never copied into memory all at once
+        for start in range(0, len(arr), 256):
+            res.update(np.ascontiguousarray(arr[start:start + 256]).tobytes())
+    return res.hexdigest()
+
+def defense_name(postprocess_fn):
+    if postprocess_fn is None:
+        return "none"
+    if isinstance(postprocess_fn, functools.partial):
+        return "%s%r%r" % (postprocess_fn.func.__name__, postprocess_fn.args, sorted(postprocess_fn.keywords.items()))
+    return postprocess_fn.__name__
+
+def clean_cache_key(model_path, data_x, data_t, postprocess_fn = None):
+    key = "%s %s %s" % (checkpoint_hash(model_path), data_hash(data_x, data_t), defense_name(postprocess_fn))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def load_clean_cache(cache_dir, key):
+    paths = [os.path.join(cache_dir, "%s_%s.npy" % (key, name)) for name in clean_cache_names]
+    if not all(os.path.isfile(path) for path in paths):
+        return None
+    return [np.load(path, mmap_mode = "r") for path in paths]
+
+def save_clean_cache(cache_dir, key, arrays):
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    
+    for name, arr in zip(clean_cache_names, arrays):
+        path = os.path.join(cache_dir, "%s_%s.npy" % (key, name))
+        # write to a temporary file first so concurrent runs never see a partial cache
+        with open(path + ".tmp", "wb") as file:
+            np.save(file, arr)
+        os.rename(path + ".tmp", path)
+
+def clean_predictions(sess, ops, batch_feed_dict, batch_size, feed_dict = None, cache_dir = None, cache_key = None, shuffle_idx = None):
+    # the data is fed in its original order, so memory mapped data is read sequentially and the cache can be shared between attacks and evaluation
+    res = None
+    if cache_dir is not None:
+        res = load_clean_cache(cache_dir, cache_key)
+        if res is not None:
+            print("Loaded clean predictions from cache!")
+    
+    if res is None:
+        res = run_batches(sess, ops, batch_feed_dict, batch_size, feed_dict = feed_dict)
+        if cache_dir is not None:
+            save_clean_cache(cache_dir, cache_key, res)
+    
+    if shuffle_idx is None:
+        return res
+    return [arr[shuffle_idx] for arr in res]
+
+def read_manifest(out_dir, run_key):
+    # maps each finished (eps, target, start) unit to its record
+    path = os.path.join(out_dir, "manifest.jsonl")
+    units = {}
+    if not os.path.exists(path):
+        return units
+
+    with open(path) as file:
+        header = json.loads(file.readline())
+        if header["run"] != run_key:
+            raise ValueError("The run manifest in %s is for a different run!" % out_dir)
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # a line can be partial if the run was killed while writing it
+            if record.get("reset"):
+                # the target is attacked again from scratch, so its earlier units no longer count
+                units = {k: v for k, v in units.items() if k[:2] != (record["eps"], record["target"])}
+                continue
+            units[(record["eps"], record["target"], record["start"])] = record
+    return units
+
+def open_manifest(out_dir, run_key, resume = False):
+    path = os.path.join(out_dir, "manifest.jsonl")
+    if resume and os.path.exists(path):
+        # drop a partial last line, so the next record does not get appended to it
+        with open(path, "rb+") as file:
+            file.truncate(file.read().rfind(b"\n") + 1)
+        return open(path, "a")
+    file = open(path, "w")
+    file.write(json.dumps({"run": run_key}) + "\n")
+    file.flush()
+    return file
+
+def write_manifest(file, record):
+    file.write(json.dumps(record) + "\n")
+    # make sure the unit is on disk before moving on, since its shard is already written
+    file.flush()
+    os.fsync(file.fileno())
+
+def write_untargeted_stats(out_dir, eps_str, class_names, total, class_totals, preds, confidences, preds_adv, confidences_adv, iters = None):
+    # the confidences are the probabilities of the clean and adversarial predictions, and iters is only given when stopping early
+    correct = len(preds)
+
+    if iters is not None:
+        print("Average iterations used: %.3f" % np.mean(iters))
+
+    succeeded_idx = preds_adv != preds
+    succeeded = np.sum(succeeded_idx)
+    
+    class_changes = np.zeros(shape = (len(class_names), len(class_names)), dtype = int)
+    np.add.at(class_changes, [preds, preds_adv], 1)
+
+    class_change_heatmap(class_changes, os.path.join(out_dir, "class_changes_eps_%s.eps" % eps_str), class_names = class_names, percentages = False)
+    class_change_heatmap(class_changes, os.path.join(out_dir, "percent_class_changes_eps_%s.eps" % eps_str), class_names = class_names, annotate = False)
+
+    class_correct = np.zeros(shape = len(class_names), dtype = int)
+    np.add.at(class_correct, preds, 1)
+    class_succeeded = np.zeros(shape = len(class_names), dtype = int)
+    np.add.at(class_succeeded, preds[succeeded_idx], 1)
+
+    with open(os.path.join(out_dir, "class_stats_eps_%s.csv" % eps_str), "w") as f:
+        f.write("Average confidence for correct predictions: %.3f\n" % np.mean(confidences))
+        f.write("Average confidence for successful adversarial predictions: %.3f\n" % np.mean(confidences_adv[succeeded_idx]))
+        f.write("Average confidence for unsuccessful adversarial predictions: %.3f\n" % np.mean(confidences_adv[~succeeded_idx]))
+        if iters is not None:
+            f.write("Average iterations used: %.3f\n" % np.mean(iters))
+        f.write("Index, Original Class, Total, Correct, Attacks Succeeded, Succeeded / Correct\n")
+
+        for i in range(len(class_names)):
+            percent = 0 if class_correct[i] == 0 else float(class_succeeded[i]) / class_correct[i]
+            f.write("%d, %s, %d, %d, %d, %.3f\n" % (i, class_names[i], class_totals[i], class_correct[i], class_succeeded[i], percent))
+        
+        percent = 0 if correct == 0 else float(succeeded) / correct
+        f.write("Total, Total, %d, %d, %d, %.3f\n" % (total, correct, succeeded, percent))
+
+def write_targeted_stats(out_dir, eps_str, class_names, total, preds, confidences, preds_adv, confidences_adv, iters = None):
+    # the adversarial arrays have one row for each target class
+    correct = len(preds)
+    num_classes = len(class_names)
+
+    class_correct = np.zeros(shape = num_classes, dtype = int)
+    np.add.at(class_correct, preds, 1)
+    heatmap_totals = np.tile(class_correct, (num_classes, 1)).T
+
+    success_counts = np.zeros(shape = (num_classes, num_classes), dtype = int)
+    total_succeeded = 0
+    total_successful_confidence = 0
+    total_unsuccessful_confidence = 0
+    total_iters = 0
+
+    for curr_target in range(num_classes):
+        succeeded_idx = (preds != curr_target) & (preds_adv[curr_target] == curr_target)
+        total_succeeded += np.sum(succeeded_idx)
+        
+        total_successful_confidence += np.mean(confidences_adv[curr_target][succeeded_idx])
+        total_unsuccessful_confidence += np.mean(confidences_adv[curr_target][~succeeded_idx])
+        if iters is not None:
+            total_iters += np.mean(iters[curr_target])
+
+        np.add.at(success_counts, [preds[succeeded_idx], preds_adv[curr_target][succeeded_idx]], 1)
+
+    targeted_success_rate_heatmap(success_counts, os.path.join(out_dir, "success_count_eps_%s.eps" % eps_str), class_names = class_names)
+    targeted_success_rate_heatmap(success_counts, os.path.join(out_dir, "success_rate_eps_%s.eps" % eps_str), total = heatmap_totals, class_names = class_names)
+
+    total_succeeded /= float(num_classes)
+    total_successful_confidence /= float(num_classes)
+    total_unsuccessful_confidence /= float(num_classes)
+    total_iters /= float(num_classes)
+
+    if iters is not None:
+        print("Average iterations used: %.3f" % total_iters)
+
+    with open(os.path.join(out_dir, "targeted_stats_eps_%s.csv" % eps_str), "w") as f:
+        f.write("Average confidence for correct predictions: %.3f\n" % np.mean(confidences))
+        f.write("Average confidence for successful adversarial predictions: %.3f\n" % total_successful_confidence)
+        f.write("Average confidence for unsuccessful adversarial predictions: %.3f\n" % total_unsuccessful_confidence)
+        if iters is not None:
+            f.write("Average iterations used: %.3f\n" % total_iters)
+        
+        percent = 0 if correct == 0 else float(total_succeeded) / correct
+        f.write("Total %d, Correct %d, Average Attacks Succeeded For All Target Classes %d, Average Succeeded / Correct %.3f\n" % (total, correct, total_succeeded, percent))
+
+def save_worker_stats(out_dir, eps_str, **arrays):
+    # a worker only sees its share of the objects, so the launcher merges these arrays from every worker to write the stats
+    np.savez(os.path.join(out_dir, "worker_stats_eps_%s.npz" % eps_str), **arrays)
+
+def cache_clean_predictions(model_path, x_pl, t_pl, model_loss_fn, data_x, data_t, clean_cache_dir, one_hot = True, postprocess_fn = None, extra_feed_dict = None, batch_size = 1):
+    # fills the cache that the attacks read their clean predictions from, so parallel workers do not each run the clean pass
+    data_x = np.asarray(data_x)
+    data_t = np.asarray(data_t)
+    cache_key = clean_cache_key(model_path, data_x, data_t, postprocess_fn)
+    if load_clean_cache(clean_cache_dir, cache_key) is not None:
+        print("Clean predictions are already cached!")
+        return
+    if postprocess_fn is None:
+        postprocess_fn = lambda x, y: x
+    if extra_feed_dict is None:
+        extra_feed_dict = {}
+
+    def_logits_op, _ = model_loss_fn(postprocess_fn(x_pl, model_loss_fn), t_pl)
+    def_loss_op = adversarial_attacks.object_loss_op(def_logits_op, t_pl, one_hot = one_hot)
+    def_probs_op = tf.nn.softmax(def_logits_op)
+
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    with tf.Session(config = config) as sess:
+        restore_model(sess, model_path)
+        print("Restored model!")
+
+        clean_predictions(sess, [def_logits_op, def_loss_op, def_probs_op], {x_pl: data_x, t_pl: data_t}, batch_size, feed_dict = extra_feed_dict, cache_dir = clean_cache_dir, cache_key = cache_key)
+
+def untargeted_attack(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data_t, num_objects, class_names, iter, eps_list, norm = "inf", data_f = None, restrict = False, one_hot = True, mode = "iterative", momentum = 1.0, clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0, postprocess_fn = None, extra_feed_dict = None, batch_size = 1, clean_cache_dir = None, loop = False, sweep_eps = False, early_stop = False, data_ids = None, worker = 0, num_workers = 1, intra_op_threads = 0, inter_op_threads = 0):
+    if clean_cache_dir is not None:
+        cache_key = clean_cache_key(model_path, data_x, data_t, postprocess_fn)
+    else:
+        cache_key = None
     if postprocess_fn is None:
         postprocess_fn = lambda x, y: x
     if extra_feed_dict is None:
@@ -87,191 +404,191 @@ def untargeted_attack(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, da
         if e.errno != errno.EEXIST:
             raise
     
-    def_logits_op, def_loss_op = model_loss_fn(postprocess_fn(x_pl, model_loss_fn), t_pl)
+    def_logits_op, _ = model_loss_fn(postprocess_fn(x_pl, model_loss_fn), t_pl)
+    def_loss_op = adversarial_attacks.object_loss_op(def_logits_op, t_pl, one_hot = one_hot)
     def_probs_op = tf.nn.softmax(def_logits_op)
 
-    logits_op, loss_op = model_loss_fn(x_pl, t_pl)
+    logits_op, _ = model_loss_fn(x_pl, t_pl)
     probs_op = tf.nn.softmax(logits_op)
 
-    data_x = np.array(data_x)
-    data_t = np.array(data_t)
+    # memory mapped data is only read as needed
+    data_x = np.asarray(data_x)
+    data_t = np.asarray(data_t)
     if data_f is not None:
-        data_f = np.array(data_f)
+        data_f = np.asarray(data_f)
+    # only the stable ids from sample_point_clouds.py are written, so results without them are joined by their contents instead of their positions
+    if data_ids is not None:
+        data_ids = np.asarray(data_ids)
     eps_list = np.array(eps_list)
 
+    # only the labels are shuffled here, and the other arrays are indexed once the correct objects are known
     shuffle_idx = np.random.permutation(len(data_x))
-    data_x = data_x[shuffle_idx]
+    unshuffled_t = data_t
     data_t = data_t[shuffle_idx]
-    if data_f is not None:
-        data_f = data_f[shuffle_idx]
 
-    eps = tf.placeholder(tf.float32, shape = [])
+    if sweep_eps:
+        if mode == "view":
+            raise ValueError("View mode does not support sweeping over eps values!")
+        # each object in the batch gets its own eps, so all eps values can be stacked on the batch axis
+        eps = tf.placeholder(tf.float32, shape = [batch_size, 1, 1])
+    else:
+        eps = tf.placeholder(tf.float32, shape = [])
     if data_f is None:
         faces = None
     else:
-        faces = tf.placeholder(tf.float32, shape = [1, None, 3, 3])
+        faces = tf.placeholder(tf.float32, shape = [batch_size, None, 3, 3])
+
+    if loop or early_stop:
+        if mode not in ["iterative", "momentum", "saliency", "saliency_pair"]:
+            raise ValueError("Only iterative, momentum, saliency, and saliency_pair modes support graph-level loops and early stopping!")
+        # the number of iterations is only known at runtime, so one graph works for any iter
+        iter = tf.placeholder_with_default(iter, shape = [])
 
     if mode == "iterative":
-        x_adv_op = postprocess_fn(adversarial_attacks.iter_grad_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter, eps = eps, ord = norm, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm), model_loss_fn)
+        x_adv_op = adversarial_attacks.iter_grad_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter, eps = eps, ord = norm, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm, loop = loop, early_stop = early_stop)
     elif mode == "momentum":
-        x_adv_op = postprocess_fn(adversarial_attacks.momentum_grad_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter, eps = eps, ord = norm, momentum = momentum, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm), model_loss_fn)
+        x_adv_op = adversarial_attacks.momentum_grad_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter, eps = eps, ord = norm, momentum = momentum, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm, loop = loop, early_stop = early_stop)
     elif mode == "saliency":
-        x_adv_op = postprocess_fn(adversarial_attacks.jacobian_saliency_map_points_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter, eps = eps, restrict = restrict, clip_min = clip_min, clip_max = clip_max), model_loss_fn)
+        x_adv_op = adversarial_attacks.jacobian_saliency_map_points_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter, eps = eps, restrict = restrict, clip_min = clip_min, clip_max = clip_max, loop = loop, early_stop = early_stop)
+    elif mode == "saliency_pair":
+        x_adv_op = adversarial_attacks.jacobian_saliency_map_pair_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter, eps = eps, restrict = restrict, clip_min = clip_min, clip_max = clip_max, loop = loop, early_stop = early_stop)
     elif mode == "sort":
-        x_adv_op = postprocess_fn(adversarial_attacks.sort_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter), model_loss_fn)
+        x_adv_op = adversarial_attacks.sort_op(x_pl, model_loss_fn, faces = faces, one_hot = one_hot, iter = iter)
     elif mode == "view":
-        x_adv_op = postprocess_fn(adversarial_attacks.view_op(x_pl, model_loss_fn, one_hot = one_hot, iter = iter, eps = eps), model_loss_fn)
+        if batch_size != 1:
+            raise ValueError("View mode only supports a batch size of 1!")
+        x_adv_op = adversarial_attacks.view_op(x_pl, model_loss_fn, one_hot = one_hot, iter = iter, eps = eps)
     else:
-        raise ValueError("Only iterative, momentum, saliency, sort, and view modes are supported!")
-    
-    saver = tf.train.Saver()
+        raise ValueError("Only iterative, momentum, saliency, saliency_pair, sort, and view modes are supported!")
 
-    config = tf.ConfigProto()
+    if early_stop:
+        x_adv_op, iters_op = x_adv_op
+    x_adv_op = postprocess_fn(x_adv_op, model_loss_fn)
+    
+    # 0 lets TensorFlow pick the number of threads
+    config = tf.ConfigProto(intra_op_parallelism_threads = intra_op_threads, inter_op_parallelism_threads = inter_op_threads)
     config.gpu_options.allow_growth = True
     with tf.Session(config = config) as sess:
-        saver.restore(sess, model_path)
+        restore_model(sess, model_path)
         print("Restored model!")
 
-        succeeded_x_original = []
-        succeeded_target = []
-        succeeded_x_adv = []
-        succeeded_pred_adv = []
-        if data_f is not None:
-            succeeded_faces = []
-
         total = len(data_x)
 
-        logits = []
-        losses = []
-        preds = []
-        probs = []
-        for i in range(total):
-            feed_dict = {
-                x_pl: [data_x[i]],
-                t_pl: [data_t[i]]
-            }
-            feed_dict.update(extra_feed_dict)
-            curr_logit, curr_loss, curr_prob = sess.run([def_logits_op, def_loss_op, def_probs_op], feed_dict = feed_dict)
-            curr_pred = np.argmax(curr_logit, axis = 1)
-            logits.append(curr_logit)
-            losses.append(curr_loss)
-            preds.append(curr_pred)
-            probs.append(curr_prob)
-        
-        logits = np.concatenate(logits)
-        losses = np.array(losses)
-        preds = np.concatenate(preds)
-        probs = np.concatenate(probs)
+        logits, losses, probs = clean_predictions(sess, [def_logits_op, def_loss_op, def_probs_op], {x_pl: data_x, t_pl: unshuffled_t}, batch_size, feed_dict = extra_feed_dict, cache_dir = clean_cache_dir, cache_key = cache_key, shuffle_idx = shuffle_idx)
+        preds = np.argmax(logits, axis = 1)
 
         if one_hot:
             sparse_t = np.argmax(data_t, axis = 1)
         else:
             sparse_t = data_t
         
-        correct_idx = preds == sparse_t
-        logits = logits[correct_idx][:num_objects]
-        preds = preds[correct_idx][:num_objects]
-        losses = losses[correct_idx][:num_objects]
-        probs = probs[correct_idx][:num_objects]
-        data_x = data_x[correct_idx][:num_objects]
-        data_t = data_t[correct_idx][:num_objects]
+        correct_idx = np.flatnonzero(preds == sparse_t)[:num_objects]
+        # each worker process attacks a contiguous share of the correct objects, so concatenating the results of the workers keeps their order
+        correct_idx = np.array_split(correct_idx, num_workers)[worker]
+        logits = logits[correct_idx]
+        preds = preds[correct_idx]
+        losses = losses[correct_idx]
+        probs = probs[correct_idx]
+        data_idx = shuffle_idx[correct_idx]
+        data_x = np.array(data_x[data_idx])
+        data_t = data_t[correct_idx]
+        if data_ids is not None:
+            data_ids = data_ids[data_idx]
         if data_f is not None:
-            data_f = data_f[correct_idx][:num_objects]
+            data_f = np.array(data_f[data_idx])
 
         correct = len(data_x)
 
         class_totals = np.zeros(shape = len(class_names), dtype = int)
         np.add.at(class_totals, sparse_t, 1)
-        class_correct = np.zeros(shape = len(class_names), dtype = int)
-        np.add.at(class_correct, preds, 1)
 
         print("Evaluated model!")
         print("Generating adversarial inputs...")
 
-        for curr_eps in eps_list:
+        results_paths = [os.path.join(out_dir, "succeeded_point_clouds_eps_%s.npz" % str(curr_eps).replace(".", "_")) for curr_eps in eps_list]
+        all_preds_adv = np.zeros(shape = (len(eps_list), correct), dtype = int)
+        all_confidences_adv = np.zeros(shape = (len(eps_list), correct))
+        all_iters = np.zeros(shape = (len(eps_list), correct))
+        attack_ops = [x_adv_op, iters_op] if early_stop else [x_adv_op]
+
+        empty = empty_results(data_x, data_t, data_ids, data_f = data_f, pred_adv = True)
+
+        def write_succeeded(writer, idx, x_adv, preds_adv):
+            succeeded_idx = preds_adv != preds[idx]
+            arrays = {
+                "x_original": data_x[idx][succeeded_idx],
+                "labels": data_t[idx][succeeded_idx],
+                "x_adv": x_adv[succeeded_idx],
+                "pred_adv": preds_adv[succeeded_idx]
+            }
+            if data_ids is not None:
+                arrays["ids"] = data_ids[idx][succeeded_idx]
+            if data_f is not None:
+                arrays["faces"] = data_f[idx][succeeded_idx]
+            writer.append(**arrays)
+
+        if sweep_eps:
+            print("Attacking with all eps values at once...")
+
+            writers = [result_writer.ResultWriter(path, empty = empty) for path in results_paths]
+            eps_idx, obj_idx = np.divmod(np.arange(len(eps_list) * correct), correct)
+            batch_feed_dict = {
+                x_pl: IndexedArray(data_x, obj_idx),
+                eps: IndexedArray(eps_list[:, np.newaxis, np.newaxis], eps_idx)
+            }
+            if data_f is not None:
+                batch_feed_dict[faces] = IndexedArray(data_f, obj_idx)
+            for start, end, outputs, preds_adv, probs_adv in score_batches(sess, attack_ops, logits_op, probs_op, x_pl, batch_feed_dict, batch_size, feed_dict = extra_feed_dict, extra_feed_dict = extra_feed_dict):
+                curr_eps_idx = eps_idx[start:end]
+                curr_obj_idx = obj_idx[start:end]
+                all_preds_adv[curr_eps_idx, curr_obj_idx] = preds_adv
+                all_confidences_adv[curr_eps_idx, curr_obj_idx] = probs_adv[range(end - start), preds_adv]
+                if early_stop:
+                    all_iters[curr_eps_idx, curr_obj_idx] = outputs[1]
+                for i in np.unique(curr_eps_idx):
+                    write_succeeded(writers[i], curr_obj_idx[curr_eps_idx == i], outputs[0][curr_eps_idx == i], preds_adv[curr_eps_idx == i])
+            
+            for writer in writers:
+                writer.close()
+
+        for curr_eps_idx, curr_eps in enumerate(eps_list):
             print("Current eps: %s" % curr_eps)
 
-            x_adv = []
-            for i in range(correct):
-                feed_dict = {
-                    x_pl: [data_x[i]],
-                    eps: curr_eps
-                }
+            if not sweep_eps:
+                # the succeeded adversarial examples are written as each batch finishes
+                writer = result_writer.ResultWriter(results_paths[curr_eps_idx], empty = empty)
+                batch_feed_dict = {x_pl: data_x}
                 if data_f is not None:
-                    feed_dict[faces] = [data_f[i]]
+                    batch_feed_dict[faces] = data_f
+                feed_dict = {eps: curr_eps}
                 feed_dict.update(extra_feed_dict)
-                curr_x_adv = sess.run(x_adv_op, feed_dict = feed_dict)
-                x_adv.append(curr_x_adv)
-            
-            x_adv = np.concatenate(x_adv)
-
-            logits_adv = []
-            losses_adv = []
-            preds_adv = []
-            probs_adv = []
-            for i in range(correct):
-                feed_dict = {
-                    x_pl: [x_adv[i]],
-                    t_pl: [data_t[i]]
-                }
-                feed_dict.update(extra_feed_dict)
-                curr_logit_adv, curr_loss_adv, curr_prob_adv = sess.run([logits_op, loss_op, probs_op], feed_dict = feed_dict)
-                curr_pred_adv = np.argmax(curr_logit_adv, axis = 1)
-                logits_adv.append(curr_logit_adv)
-                losses_adv.append(curr_loss_adv)
-                preds_adv.append(curr_pred_adv)
-                probs_adv.append(curr_prob_adv)
-            
-            logits_adv = np.concatenate(logits_adv)
-            losses_adv = np.array(losses_adv)
-            preds_adv = np.concatenate(preds_adv)
-            probs_adv = np.concatenate(probs_adv)
-
-            succeeded_idx = preds_adv != preds
-            succeeded = np.sum(succeeded_idx)
-            succeeded_x_original.append(data_x[succeeded_idx])
-            succeeded_target.append(data_t[succeeded_idx])
-            succeeded_x_adv.append(x_adv[succeeded_idx])
-            succeeded_pred_adv.append(preds_adv[succeeded_idx])
-            if data_f is not None:
-                succeeded_faces.append(data_f[succeeded_idx])
-            
-            class_changes = np.zeros(shape = (len(class_names), len(class_names)), dtype = int)
-            np.add.at(class_changes, [preds, preds_adv], 1)
+                for start, end, outputs, preds_adv, probs_adv in score_batches(sess, attack_ops, logits_op, probs_op, x_pl, batch_feed_dict, batch_size, feed_dict = feed_dict, extra_feed_dict = extra_feed_dict):
+                    all_preds_adv[curr_eps_idx, start:end] = preds_adv
+                    all_confidences_adv[curr_eps_idx, start:end] = probs_adv[range(end - start), preds_adv]
+                    if early_stop:
+                        all_iters[curr_eps_idx, start:end] = outputs[1]
+                    write_succeeded(writer, np.arange(start, end), outputs[0], preds_adv)
+                writer.close()
 
             eps_str = str(curr_eps).replace(".", "_")
-            class_change_heatmap(class_changes, os.path.join(out_dir, "class_changes_eps_%s.eps" % eps_str), class_names = class_names, percentages = False)
-            class_change_heatmap(class_changes, os.path.join(out_dir, "percent_class_changes_eps_%s.eps" % eps_str), class_names = class_names, annotate = False)
-
-            class_succeeded = np.zeros(shape = len(class_names), dtype = int)
-            np.add.at(class_succeeded, preds[succeeded_idx], 1)
-
-            with open(os.path.join(out_dir, "class_stats_eps_%s.csv" % eps_str), "w") as f:
-                f.write("Average confidence for correct predictions: %.3f\n" % np.mean(probs[range(correct), preds]))
-                f.write("Average confidence for successful adversarial predictions: %.3f\n" % np.mean(probs_adv[succeeded_idx][range(succeeded), preds_adv[succeeded_idx]]))
-                f.write("Average confidence for unsuccessful adversarial predictions: %.3f\n" % np.mean(probs_adv[~succeeded_idx][range(correct - succeeded), preds_adv[~succeeded_idx]]))
-                f.write("Index, Original Class, Total, Correct, Attacks Succeeded, Succeeded / Correct\n")
-
-                for i in range(len(class_names)):
-                    percent = 0 if class_correct[i] == 0 else float(class_succeeded[i]) / class_correct[i]
-                    f.write("%d, %s, %d, %d, %d, %.3f\n" % (i, class_names[i], class_totals[i], class_correct[i], class_succeeded[i], percent))
-                
-                percent = 0 if correct == 0 else float(succeeded) / correct
-                f.write("Total, Total, %d, %d, %d, %.3f\n" % (total, correct, succeeded, percent))
-
-            if data_f is None:
-                np.savez_compressed(os.path.join(out_dir, "succeeded_point_clouds_eps_%s.npz" % eps_str), x_original = succeeded_x_original[-1], labels = succeeded_target[-1], x_adv = succeeded_x_adv[-1], pred_adv = succeeded_pred_adv[-1])
-            else:
-                np.savez_compressed(os.path.join(out_dir, "succeeded_point_clouds_eps_%s.npz" % eps_str), x_original = succeeded_x_original[-1], labels = succeeded_target[-1], x_adv = succeeded_x_adv[-1], pred_adv = succeeded_pred_adv[-1], faces = succeeded_faces[-1])
+            confidences = probs[range(correct), preds]
+            iters = all_iters[curr_eps_idx] if early_stop else None
+            write_untargeted_stats(out_dir, eps_str, class_names, total, class_totals, preds, confidences, all_preds_adv[curr_eps_idx], all_confidences_adv[curr_eps_idx], iters = iters)
+            if num_workers > 1:
+                save_worker_stats(out_dir, eps_str, total = total, class_totals = class_totals, preds = preds, confidences = confidences, preds_adv = all_preds_adv[curr_eps_idx], confidences_adv = all_confidences_adv[curr_eps_idx], iters = all_iters[curr_eps_idx], early_stop = early_stop)
 
     print("Done!")
 
-    if data_f is None:
-        return succeeded_x_original, succeeded_target, succeeded_x_adv, succeeded_pred_adv
-    else:
-        return succeeded_x_original, succeeded_target, succeeded_x_adv, succeeded_pred_adv, succeeded_faces
+    # the results are on disk, so only their paths are returned to keep memory bounded
+    return results_paths
 
-def targeted_attack(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data_t, num_objects, class_names, iter, eps_list, norm = "inf", data_f = None, restrict = False, one_hot = True, mode = "iterative", momentum = 1.0, clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0, postprocess_fn = None, extra_feed_dict = None):
+def targeted_attack(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data_t, num_objects, class_names, iter, eps_list, norm = "inf", data_f = None, restrict = False, one_hot = True, mode = "iterative", momentum = 1.0, clip_min = None, clip_max = None, clip_norm = None, min_norm = 0.0, postprocess_fn = None, extra_feed_dict = None, batch_size = 1, clean_cache_dir = None, vectorize_targets = False, loop = False, early_stop = False, resume = False, data_ids = None, worker = 0, num_workers = 1, intra_op_threads = 0, inter_op_threads = 0):
+    if clean_cache_dir is not None:
+        cache_key = clean_cache_key(model_path, data_x, data_t, postprocess_fn)
+    else:
+        cache_key = None
+    # everything that changes the adversarial examples, so a resumed run can check that it continues the same run
+    run_settings = [defense_name(postprocess_fn), iter, norm, restrict, one_hot, mode, momentum, clip_min, clip_max, clip_norm, min_norm, batch_size, vectorize_targets, early_stop, [float(curr_eps) for curr_eps in eps_list]]
     if postprocess_fn is None:
         postprocess_fn = lambda x, y: x
     if extra_feed_dict is None:
@@ -282,215 +599,245 @@ def targeted_attack(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data
         if e.errno != errno.EEXIST:
             raise
     
-    def_logits_op, def_loss_op = model_loss_fn(postprocess_fn(x_pl, model_loss_fn), t_pl)
+    def_logits_op, _ = model_loss_fn(postprocess_fn(x_pl, model_loss_fn), t_pl)
+    def_loss_op = adversarial_attacks.object_loss_op(def_logits_op, t_pl, one_hot = one_hot)
     def_probs_op = tf.nn.softmax(def_logits_op)
 
-    logits_op, loss_op = model_loss_fn(x_pl, t_pl)
+    logits_op, _ = model_loss_fn(x_pl, t_pl)
     probs_op = tf.nn.softmax(logits_op)
 
-    data_x = np.array(data_x)
-    data_t = np.array(data_t)
+    data_x = np.asarray(data_x)
+    data_t = np.asarray(data_t)
     if data_f is not None:
-        data_f = np.array(data_f)
+        data_f = np.asarray(data_f)
+    if data_ids is not None:
+        data_ids = np.asarray(data_ids)
     eps_list = np.array(eps_list)
 
     shuffle_idx = np.random.permutation(len(data_x))
-    data_x = data_x[shuffle_idx]
+    unshuffled_t = data_t
     data_t = data_t[shuffle_idx]
-    if data_f is not None:
-        data_f = data_f[shuffle_idx]
 
+    num_classes = len(class_names)
     eps = tf.placeholder(tf.float32, shape = [])
-    if one_hot:
-        target = tf.placeholder(tf.float32, shape = [1, len(class_names)])
-    else:
-        target = tf.placeholder(tf.int32, [1])
     if data_f is None:
         faces = None
     else:
-        faces = tf.placeholder(tf.float32, shape = [1, None, 3, 3])
+        faces = tf.placeholder(tf.float32, shape = [batch_size, None, 3, 3])
+
+    if vectorize_targets:
+        # attack every (object, target) pair in the batch at once
+        x_in = tile_op(x_pl, num_classes)
+        target = tf.tile(tf.range(num_classes), [batch_size])
+        if one_hot:
+            target = tf.one_hot(target, num_classes)
+        faces_in = None if faces is None else tile_op(faces, num_classes)
+    else:
+        x_in = x_pl
+        if one_hot:
+            target = tf.placeholder(tf.float32, shape = [batch_size, num_classes])
+        else:
+            target = tf.placeholder(tf.int32, [batch_size])
+        faces_in = faces
+
+    if loop or early_stop:
+        if mode not in ["iterative", "momentum", "saliency", "saliency_pair"]:
+            raise ValueError("Only iterative, momentum, saliency, and saliency_pair modes support graph-level loops and early stopping!")
+        iter = tf.placeholder_with_default(iter, shape = [])
     
     if mode == "iterative":
-        x_adv_op = postprocess_fn(adversarial_attacks.iter_grad_op(x_pl, model_loss_fn, t_pl = target, faces = faces, one_hot = one_hot, iter = iter, eps = eps, ord = norm, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm), model_loss_fn)
+        x_adv_op = adversarial_attacks.iter_grad_op(x_in, model_loss_fn, t_pl = target, faces = faces_in, one_hot = one_hot, iter = iter, eps = eps, ord = norm, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm, loop = loop, early_stop = early_stop)
     elif mode == "momentum":
-        x_adv_op = postprocess_fn(adversarial_attacks.momentum_grad_op(x_pl, model_loss_fn, t_pl = target, faces = faces, one_hot = one_hot, iter = iter, eps = eps, ord = norm, momentum = momentum, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm), model_loss_fn)
+        x_adv_op = adversarial_attacks.momentum_grad_op(x_in, model_loss_fn, t_pl = target, faces = faces_in, one_hot = one_hot, iter = iter, eps = eps, ord = norm, momentum = momentum, restrict = restrict, clip_min = clip_min, clip_max = clip_max, clip_norm = clip_norm, min_norm = min_norm, loop = loop, early_stop = early_stop)
     elif mode == "saliency":
-        x_adv_op = postprocess_fn(adversarial_attacks.jacobian_saliency_map_points_op(x_pl, model_loss_fn, t_pl = target, faces = faces, one_hot = one_hot, iter = iter, eps = eps, restrict = restrict, clip_min = clip_min, clip_max = clip_max), model_loss_fn)
+        x_adv_op = adversarial_attacks.jacobian_saliency_map_points_op(x_in, model_loss_fn, t_pl = target, faces = faces_in, one_hot = one_hot, iter = iter, eps = eps, restrict = restrict, clip_min = clip_min, clip_max = clip_max, loop = loop, early_stop = early_stop)
+    elif mode == "saliency_pair":
+        x_adv_op = adversarial_attacks.jacobian_saliency_map_pair_op(x_in, model_loss_fn, t_pl = target, faces = faces_in, one_hot = one_hot, iter = iter, eps = eps, restrict = restrict, clip_min = clip_min, clip_max = clip_max, loop = loop, early_stop = early_stop)
     else:
-        raise ValueError("Only iterative, momentum, and saliency modes are supported!")
+        raise ValueError("Only iterative, momentum, saliency, and saliency_pair modes are supported!")
+
+    if early_stop:
+        x_adv_op, iters_op = x_adv_op
+    x_adv_op = postprocess_fn(x_adv_op, model_loss_fn)
+
+    if vectorize_targets:
+        # score the adversarial examples in the same run instead of feeding them back in
+        logits_adv_op, _ = model_loss_fn(x_adv_op, None)
+        probs_adv_op = tf.nn.softmax(logits_adv_op)
+        x_adv_op = tf.reshape(x_adv_op, [batch_size, num_classes] + x_pl.shape.as_list()[1:])
+        logits_adv_op = tf.reshape(logits_adv_op, [batch_size, num_classes, -1])
+        probs_adv_op = tf.reshape(probs_adv_op, [batch_size, num_classes, -1])
+        if early_stop:
+            iters_op = tf.reshape(iters_op, [batch_size, num_classes])
     
-    saver = tf.train.Saver()
-
-    config = tf.ConfigProto()
+    config = tf.ConfigProto(intra_op_parallelism_threads = intra_op_threads, inter_op_parallelism_threads = inter_op_threads)
     config.gpu_options.allow_growth = True
     with tf.Session(config = config) as sess:
-        saver.restore(sess, model_path)
+        restore_model(sess, model_path)
         print("Model restored!")
-        
-        succeeded_x_original = []
-        succeeded_target = []
-        succeeded_x_adv = []
-        if data_f is not None:
-            succeeded_faces = []
 
         total = len(data_x)
 
-        logits = []
-        losses = []
-        preds = []
-        probs = []
-        for i in range(total):
-            feed_dict = {
-                x_pl: [data_x[i]],
-                t_pl: [data_t[i]]
-            }
-            feed_dict.update(extra_feed_dict)
-            curr_logit, curr_loss, curr_prob = sess.run([def_logits_op, def_loss_op, def_probs_op], feed_dict = feed_dict)
-            curr_pred = np.argmax(curr_logit, axis = 1)
-            logits.append(curr_logit)
-            losses.append(curr_loss)
-            preds.append(curr_pred)
-            probs.append(curr_prob)
-        
-        logits = np.concatenate(logits)
-        losses = np.array(losses)
-        preds = np.concatenate(preds)
-        probs = np.concatenate(probs)
+        logits, losses, probs = clean_predictions(sess, [def_logits_op, def_loss_op, def_probs_op], {x_pl: data_x, t_pl: unshuffled_t}, batch_size, feed_dict = extra_feed_dict, cache_dir = clean_cache_dir, cache_key = cache_key, shuffle_idx = shuffle_idx)
+        preds = np.argmax(logits, axis = 1)
 
         if one_hot:
             sparse_t = np.argmax(data_t, axis = 1)
         else:
             sparse_t = data_t
         
-        correct_idx = preds == sparse_t
-        logits = logits[correct_idx][:num_objects]
-        preds = preds[correct_idx][:num_objects]
-        losses = losses[correct_idx][:num_objects]
-        probs = probs[correct_idx][:num_objects]
-        data_x = data_x[correct_idx][:num_objects]
-        data_t = data_t[correct_idx][:num_objects]
+        correct_idx = np.flatnonzero(preds == sparse_t)[:num_objects]
+        correct_idx = np.array_split(correct_idx, num_workers)[worker]
+        logits = logits[correct_idx]
+        preds = preds[correct_idx]
+        losses = losses[correct_idx]
+        probs = probs[correct_idx]
+        data_idx = shuffle_idx[correct_idx]
+        data_x = np.array(data_x[data_idx])
+        data_t = data_t[correct_idx]
+        if data_ids is not None:
+            data_ids = data_ids[data_idx]
         if data_f is not None:
-            data_f = data_f[correct_idx][:num_objects]
+            data_f = np.array(data_f[data_idx])
 
         correct = len(data_x)
 
-        class_totals = np.zeros(shape = len(class_names), dtype = int)
-        np.add.at(class_totals, sparse_t, 1)
-        class_correct = np.zeros(shape = len(class_names), dtype = int)
-        np.add.at(class_correct, preds, 1)
-        heatmap_totals = np.tile(class_correct, (len(class_names), 1)).T
-
         print("Model evaluated!")
         print("Generating adversarial inputs...")
 
+        results_paths = []
+        attack_ops = [x_adv_op, iters_op] if early_stop else [x_adv_op]
+
+        # the run is split into (eps, target, batch) units, and finished units are recorded in a manifest so an interrupted run can be resumed
+        run_key = hashlib.sha1(json.dumps([checkpoint_hash(model_path), data_hash(data_x, data_t)] + run_settings).encode()).hexdigest()
+        units = read_manifest(out_dir, run_key) if resume else {}
+        manifest = open_manifest(out_dir, run_key, resume = resume)
+        starts = list(range(0, correct, batch_size))
+        empty = empty_results(data_x, data_t, data_ids, data_f = data_f)
+
+        def write_unit(writer, eps_str, curr_target, start, end, x_adv, preds_adv, probs_adv, iters):
+            succeeded_idx = (preds[start:end] != curr_target) & (preds_adv == curr_target)
+            arrays = {
+                "x_original": data_x[start:end][succeeded_idx],
+                "labels": data_t[start:end][succeeded_idx],
+                "x_adv": x_adv[succeeded_idx]
+            }
+            if data_ids is not None:
+                arrays["ids"] = data_ids[start:end][succeeded_idx]
+            if data_f is not None:
+                arrays["faces"] = data_f[start:end][succeeded_idx]
+            writer.append(shard = "%08d" % start, **arrays)
+
+            record = {
+                "eps": eps_str,
+                "target": curr_target,
+                "start": start,
+                "end": end,
+                "preds_adv": [int(x) for x in preds_adv],
+                "confidences": [float(x) for x in probs_adv[range(end - start), preds_adv]],
+                "iters": [float(x) for x in iters]
+            }
+            write_manifest(manifest, record)
+            units[(eps_str, curr_target, start)] = record
+
+        def unit_results(eps_str, curr_target):
+            records = [units[(eps_str, curr_target, start)] for start in starts]
+            preds_adv = np.array([x for record in records for x in record["preds_adv"]], dtype = int)
+            confidences = np.array([x for record in records for x in record["confidences"]])
+            iters = np.array([x for record in records for x in record["iters"]])
+            return preds_adv, confidences, iters
+
         for curr_eps in eps_list:
             print("Current eps: %s" % curr_eps)
 
-            curr_succeeded_x_original = []
-            curr_succeeded_target = []
-            curr_succeeded_x_adv = []
-            if data_f is not None:
-                curr_succeeded_faces = []
-            success_counts = np.zeros(shape = (len(class_names), len(class_names)), dtype = int)
-            total_succeeded = 0
-            total_successful_confidence = 0
-            total_unsuccessful_confidence = 0
             eps_str = str(curr_eps).replace(".", "_")
+            curr_results_paths = [os.path.join(out_dir, "succeeded_point_clouds_target_%s_eps_%s.npz" % (class_names[curr_target], eps_str)) for curr_target in range(len(class_names))]
+
+            for curr_target in range(num_classes):
+                if os.path.exists(curr_results_paths[curr_target]) and not all((eps_str, curr_target, start) in units for start in starts):
+                    # the shards of a merged target are already deleted, so all of it is attacked again instead of merging only the missing batches over it
+                    for start in starts:
+                        units.pop((eps_str, curr_target, start), None)
+                    write_manifest(manifest, {"eps": eps_str, "target": curr_target, "reset": True})
+                    os.remove(curr_results_paths[curr_target])
+
+            if vectorize_targets:
+                # a batch is only finished once every target is recorded
+                skip = set(start for start in starts if all((eps_str, curr_target, start) in units for curr_target in range(num_classes)))
+
+                if len(skip) < len(starts):
+                    print("Attacking all targets at once...")
+
+                    batch_feed_dict = {x_pl: data_x}
+                    if data_f is not None:
+                        batch_feed_dict[faces] = data_f
+                    feed_dict = {eps: curr_eps}
+                    feed_dict.update(extra_feed_dict)
+
+                    # the succeeded adversarial examples for every target are written as each batch finishes, except for the targets that are already merged
+                    writers = {curr_target: result_writer.ResultWriter(curr_results_paths[curr_target], resume = resume, empty = empty) for curr_target in range(num_classes) if not os.path.exists(curr_results_paths[curr_target])}
+                    ops = [x_adv_op, logits_adv_op, probs_adv_op]
+                    if early_stop:
+                        ops.append(iters_op)
+                    for start, end, outputs in iterate_batches(sess, ops, batch_feed_dict, batch_size, feed_dict = feed_dict, skip = skip):
+                        curr_x_adv, curr_logits_adv, curr_probs_adv = outputs[:3]
+                        curr_preds_adv = np.argmax(curr_logits_adv, axis = 2)
+                        curr_iters = outputs[3] if early_stop else np.zeros(shape = (end - start, num_classes))
+                        for curr_target in writers:
+                            write_unit(writers[curr_target], eps_str, curr_target, start, end, curr_x_adv[:, curr_target], curr_preds_adv[:, curr_target], curr_probs_adv[:, curr_target], curr_iters[:, curr_target])
+                    
+                    for writer in writers.values():
+                        writer.close()
 
             for curr_target in range(len(class_names)):
                 print("Current target: %s" % class_names[curr_target])
 
-                if one_hot:
-                    adv_target = np.zeros(shape = len(class_names))
-                    adv_target[curr_target] = 1
-                else:
-                    adv_target = curr_target
-                
-                x_adv = []
-                for i in range(correct):
-                    feed_dict = {
-                        x_pl: [data_x[i]],
-                        eps: curr_eps,
-                        target: [adv_target]
+                skip = set(start for start in starts if (eps_str, curr_target, start) in units)
+
+                if not vectorize_targets and len(skip) < len(starts):
+                    if one_hot:
+                        adv_target = np.zeros(shape = len(class_names))
+                        adv_target[curr_target] = 1
+                    else:
+                        adv_target = curr_target
+                    
+                    batch_feed_dict = {
+                        x_pl: data_x,
+                        target: np.repeat([adv_target], correct, axis = 0)
                     }
                     if data_f is not None:
-                        feed_dict[faces] = [data_f[i]]
+                        batch_feed_dict[faces] = data_f
+                    feed_dict = {eps: curr_eps}
                     feed_dict.update(extra_feed_dict)
-                    curr_x_adv = sess.run(x_adv_op, feed_dict = feed_dict)
-                    x_adv.append(curr_x_adv)
-                
-                x_adv = np.concatenate(x_adv)
-
-                logits_adv = []
-                losses_adv = []
-                preds_adv = []
-                probs_adv = []
-                for i in range(correct):
-                    feed_dict = {
-                        x_pl: [x_adv[i]],
-                        t_pl: [data_t[i]]
-                    }
-                    feed_dict.update(extra_feed_dict)
-                    curr_logit_adv, curr_loss_adv, curr_prob_adv = sess.run([logits_op, loss_op, probs_op], feed_dict = feed_dict)
-                    curr_pred_adv = np.argmax(curr_logit_adv, axis = 1)
-                    logits_adv.append(curr_logit_adv)
-                    losses_adv.append(curr_loss_adv)
-                    preds_adv.append(curr_pred_adv)
-                    probs_adv.append(curr_prob_adv)
-                
-                logits_adv = np.concatenate(logits_adv)
-                losses_adv = np.array(losses_adv)
-                preds_adv = np.concatenate(preds_adv)
-                probs_adv = np.concatenate(probs_adv)
-
-                succeeded_idx = (preds != curr_target) & (preds_adv == curr_target)
-                succeeded = np.sum(succeeded_idx)
-                total_succeeded += succeeded
-                curr_succeeded_x_original.append(data_x[succeeded_idx])
-                curr_succeeded_target.append(data_t[succeeded_idx])
-                curr_succeeded_x_adv.append(x_adv[succeeded_idx])
-                if data_f is not None:
-                    curr_succeeded_faces.append(data_f[succeeded_idx])
-                
-                total_successful_confidence += np.mean(probs_adv[succeeded_idx][range(succeeded), preds_adv[succeeded_idx]])
-                total_unsuccessful_confidence += np.mean(probs_adv[~succeeded_idx][range(correct - succeeded), preds_adv[~succeeded_idx]])
 
-                np.add.at(success_counts, [preds[succeeded_idx], preds_adv[succeeded_idx]], 1)
-
-                if data_f is None:
-                    np.savez_compressed(os.path.join(out_dir, "succeeded_point_clouds_target_%s_eps_%s.npz" % (class_names[curr_target], eps_str)), x_original = curr_succeeded_x_original[-1], labels = curr_succeeded_target[-1], x_adv = curr_succeeded_x_adv[-1])
-                else:
-                    np.savez_compressed(os.path.join(out_dir, "succeeded_point_clouds_target_%s_eps_%s.npz" % (class_names[curr_target], eps_str)), x_original = curr_succeeded_x_original[-1], labels = curr_succeeded_target[-1], x_adv = curr_succeeded_x_adv[-1], faces = curr_succeeded_faces[-1])
-
-            targeted_success_rate_heatmap(success_counts, os.path.join(out_dir, "success_count_eps_%s.eps" % eps_str), class_names = class_names)
-            targeted_success_rate_heatmap(success_counts, os.path.join(out_dir, "success_rate_eps_%s.eps" % eps_str), total = heatmap_totals, class_names = class_names)
-
-            total_succeeded /= float(len(class_names))
-            total_successful_confidence /= float(len(class_names))
-            total_unsuccessful_confidence /= float(len(class_names))
-
-            with open(os.path.join(out_dir, "targeted_stats_eps_%s.csv" % eps_str), "w") as f:
-                f.write("Average confidence for correct predictions: %.3f\n" % np.mean(probs[range(correct), preds]))
-                f.write("Average confidence for successful adversarial predictions: %.3f\n" % total_successful_confidence)
-                f.write("Average confidence for unsuccessful adversarial predictions: %.3f\n" % total_unsuccessful_confidence)
-                
-                percent = 0 if correct == 0 else float(total_succeeded) / correct
-                f.write("Total %d, Correct %d, Average Attacks Succeeded For All Target Classes %d, Average Succeeded / Correct %.3f\n" % (total, correct, total_succeeded, percent))
+                    # the succeeded adversarial examples are written as each batch finishes
+                    writer = result_writer.ResultWriter(curr_results_paths[curr_target], resume = resume, empty = empty)
+                    for start, end, outputs, curr_preds_adv, curr_probs_adv in score_batches(sess, attack_ops, logits_op, probs_op, x_pl, batch_feed_dict, batch_size, feed_dict = feed_dict, extra_feed_dict = extra_feed_dict, skip = skip):
+                        curr_iters = outputs[1] if early_stop else np.zeros(shape = end - start)
+                        write_unit(writer, eps_str, curr_target, start, end, outputs[0], curr_preds_adv, curr_probs_adv, curr_iters)
+                    writer.close()
+                elif not os.path.exists(curr_results_paths[curr_target]):
+                    # every unit finished, but the run was interrupted before the shards were merged
+                    result_writer.merge_shards(curr_results_paths[curr_target], empty = empty)
+
+            preds_adv, confidences_adv, iters = zip(*[unit_results(eps_str, curr_target) for curr_target in range(num_classes)])
+            preds_adv = np.array(preds_adv)
+            confidences_adv = np.array(confidences_adv)
+            iters = np.array(iters)
+            confidences = probs[range(correct), preds]
+            write_targeted_stats(out_dir, eps_str, class_names, total, preds, confidences, preds_adv, confidences_adv, iters = iters if early_stop else None)
+            if num_workers > 1:
+                save_worker_stats(out_dir, eps_str, total = total, preds = preds, confidences = confidences, preds_adv = preds_adv, confidences_adv = confidences_adv, iters = iters, early_stop = early_stop)
             
-            succeeded_x_original.append(curr_succeeded_x_original)
-            succeeded_target.append(curr_succeeded_target)
-            succeeded_x_adv.append(curr_succeeded_x_adv)
-            if data_f is not None:
-                succeeded_faces.append(curr_succeeded_faces)
+            results_paths.append(curr_results_paths)
+
+        manifest.close()
 
     print("Done!")
 
-    if data_f is None:
-        return succeeded_x_original, succeeded_target, succeeded_x_adv
-    else:
-        return succeeded_x_original, succeeded_target, succeeded_x_adv, succeeded_faces
+    return results_paths
 
-def evaluate(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data_t, class_names, data_p = None, one_hot = True, extra_feed_dict = None):
+def evaluate(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data_t, class_names, data_p = None, one_hot = True, extra_feed_dict = None, batch_size = 1, clean_cache_dir = None, postprocess_fn = None):
     if extra_feed_dict is None:
         extra_feed_dict = {}
     try:
@@ -499,89 +846,123 @@ def evaluate(model_path, out_dir, x_pl, t_pl, model_loss_fn, data_x, data_t, cla
         if e.errno != errno.EEXIST:
             raise
     
-    logits_op, loss_op = model_loss_fn(x_pl, t_pl)
+    logits_op, _ = model_loss_fn(x_pl, t_pl)
+    loss_op = adversarial_attacks.object_loss_op(logits_op, t_pl, one_hot = one_hot)
     probs_op = tf.nn.softmax(logits_op)
+    if postprocess_fn is not None:
+        def_logits_op, _ = model_loss_fn(postprocess_fn(x_pl, model_loss_fn), t_pl)
+        def_loss_op = adversarial_attacks.object_loss_op(def_logits_op, t_pl, one_hot = one_hot)
+        def_probs_op = tf.nn.softmax(def_logits_op)
 
-    data_x = np.array(data_x)
-    data_t = np.array(data_t)
+    data_x = np.asarray(data_x)
+    data_t = np.asarray(data_t)
     if data_p is not None:
-        data_p = np.array(data_p)
-
-    saver = tf.train.Saver()
-
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
-    with tf.Session(config = config) as sess:
-        saver.restore(sess, model_path)
-        print("Model restored!")
+        data_p = np.asarray(data_p)
+
+    if clean_cache_dir is not None:
+        cache_key = clean_cache_key(model_path, data_x, data_t)
+        cached = load_clean_cache(clean_cache_dir, cache_key)
+        if postprocess_fn is not None:
+            def_cache_key = clean_cache_key(model_path, data_x, data_t, postprocess_fn)
+            def_cached = load_clean_cache(clean_cache_dir, def_cache_key)
+    else:
+        cache_key = None
+        cached = None
+        def_cache_key = None
+        def_cached = None
+
+    time_per_object = None
+    def_time_per_object = None
+    if cached is None or (postprocess_fn is not None and def_cached is None):
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        with tf.Session(config = config) as sess:
+            restore_model(sess, model_path)
+            print("Model restored!")
+
+            if cached is None:
+                start_time = time.time()
+                logits, losses, probs = clean_predictions(sess, [logits_op, loss_op, probs_op], {x_pl: data_x, t_pl: data_t}, batch_size, feed_dict = extra_feed_dict, cache_dir = clean_cache_dir, cache_key = cache_key)
+                time_per_object = (time.time() - start_time) / len(data_x)
+            else:
+                logits, losses, probs = cached
 
-        logits = []
-        losses = []
-        preds = []
-        probs = []
-        for i in range(len(data_x)):
-            feed_dict = {
-                x_pl: [data_x[i]],
-                t_pl: [data_t[i]]
-            }
-            feed_dict.update(extra_feed_dict)
-            curr_logit, curr_loss, curr_prob = sess.run([logits_op, loss_op, probs_op], feed_dict = feed_dict)
-            curr_pred = np.argmax(curr_logit, axis = 1)
-            logits.append(curr_logit)
-            losses.append(curr_loss)
-            preds.append(curr_pred)
-            probs.append(curr_prob)
-        
-        logits = np.concatenate(logits)
-        losses = np.array(losses)
-        preds = np.concatenate(preds)
-        probs = np.concatenate(probs)
+            if postprocess_fn is not None:
+                if def_cached is None:
+                    start_time = time.time()
+                    def_logits, def_losses, def_probs = clean_predictions(sess, [def_logits_op, def_loss_op, def_probs_op], {x_pl: data_x, t_pl: data_t}, batch_size, feed_dict = extra_feed_dict, cache_dir = clean_cache_dir, cache_key = def_cache_key)
+                    def_time_per_object = (time.time() - start_time) / len(data_x)
+                else:
+                    def_logits, def_losses, def_probs = def_cached
+    else:
+        # no need to restore the model when every prediction is cached
+        print("Loaded clean predictions from cache!")
+        logits, losses, probs = cached
+        if postprocess_fn is not None:
+            def_logits, def_losses, def_probs = def_cached
+
+    if postprocess_fn is not None:
+        # the rest of the stats are for the defended model
+        no_def_preds = np.argmax(logits, axis = 1)
+        logits, losses, probs = def_logits, def_losses, def_probs
+    
+    preds = np.argmax(logits, axis = 1)
 
-        if one_hot:
-            sparse_t = np.argmax(data_t, axis = 1)
-            if data_p is not None:
-                sparse_p = np.argmax(data_p, axis = 1)
-        else:
-            sparse_t = data_t
-            sparse_p = data_p
-        
-        idx = preds == sparse_t
-        correct = np.sum(idx)
+    if one_hot:
+        sparse_t = np.argmax(data_t, axis = 1)
         if data_p is not None:
-            idx = preds == sparse_p
-            match = np.sum(idx)
-            avg_correct_confidence = np.mean(probs[idx][range(match), preds[idx]])
-            avg_wrong_confidence = np.mean(probs[~idx][range(len(data_x) - match), preds[~idx]])
-        else:
-            avg_correct_confidence = np.mean(probs[idx][range(correct), preds[idx]])
-            avg_wrong_confidence = np.mean(probs[~idx][range(len(data_x) - correct), preds[~idx]])
+            sparse_p = np.argmax(data_p, axis = 1)
+    else:
+        sparse_t = data_t
+        sparse_p = data_p
+    
+    idx = preds == sparse_t
+    correct = np.sum(idx)
+    if data_p is not None:
+        idx = preds == sparse_p
+        match = np.sum(idx)
+        avg_correct_confidence = np.mean(probs[idx][range(match), preds[idx]])
+        avg_wrong_confidence = np.mean(probs[~idx][range(len(data_x) - match), preds[~idx]])
+    else:
+        avg_correct_confidence = np.mean(probs[idx][range(correct), preds[idx]])
+        avg_wrong_confidence = np.mean(probs[~idx][range(len(data_x) - correct), preds[~idx]])
 
-        target_vs_preds = np.zeros(shape = (len(class_names), len(class_names)), dtype = int)
-        np.add.at(target_vs_preds, [sparse_t, preds], 1)
-        if data_p is not None:
-            preds_vs_preds = np.zeros(shape = (len(class_names), len(class_names)), dtype = int)
-            np.add.at(preds_vs_preds, [sparse_p, preds], 1)
+    target_vs_preds = np.zeros(shape = (len(class_names), len(class_names)), dtype = int)
+    np.add.at(target_vs_preds, [sparse_t, preds], 1)
+    if data_p is not None:
+        preds_vs_preds = np.zeros(shape = (len(class_names), len(class_names)), dtype = int)
+        np.add.at(preds_vs_preds, [sparse_p, preds], 1)
 
-        if data_p is None:
-            confusion_heatmap(target_vs_preds, os.path.join(out_dir, "labels_vs_preds.eps"), class_names = class_names, percentages = False)
-            confusion_heatmap(target_vs_preds, os.path.join(out_dir, "percent_labels_vs_preds.eps"), class_names = class_names, annotate = False)
-        else:
-            class_change_heatmap(target_vs_preds, os.path.join(out_dir, "labels_vs_preds.eps"), class_names = class_names, percentages = False)
-            class_change_heatmap(target_vs_preds, os.path.join(out_dir, "percent_labels_vs_preds.eps"), class_names = class_names, annotate = False)
-            transfer_heatmap(preds_vs_preds, os.path.join(out_dir, "preds_vs_preds.eps"), class_names = class_names, percentages = False)
-            transfer_heatmap(preds_vs_preds, os.path.join(out_dir, "percent_preds_vs_preds.eps"), class_names = class_names, annotate = False)
-
-        print("Total: %d" % len(data_x))
-        if data_p is None:
-            print("Correct: %d" % correct)
-            print("Correct / Total: %.3f" % (float(correct) / len(data_x)))
-        else:
-            print("Attacks Succeeded: %d" % (len(data_x) - correct))
-            print("Succeeded / Total: %.3f" % (float(len(data_x) - correct) / len(data_x)))
-            print("Transfers With Matching Predictions: %d" % match)
-            print("Matching / Succeeded: %.3f" % (float(match) / (len(data_x) - correct)))
-        print("Average confidence of correct or matching predictions: %.3f\n" % avg_correct_confidence)
-        print("Average confidence of wrong predictions: %.3f\n" % avg_wrong_confidence)
+    if data_p is None:
+        confusion_heatmap(target_vs_preds, os.path.join(out_dir, "labels_vs_preds.eps"), class_names = class_names, percentages = False)
+        confusion_heatmap(target_vs_preds, os.path.join(out_dir, "percent_labels_vs_preds.eps"), class_names = class_names, annotate = False)
+    else:
+        class_change_heatmap(target_vs_preds, os.path.join(out_dir, "labels_vs_preds.eps"), class_names = class_names, percentages = False)
+        class_change_heatmap(target_vs_preds, os.path.join(out_dir, "percent_labels_vs_preds.eps"), class_names = class_names, annotate = False)
+        transfer_heatmap(preds_vs_preds, os.path.join(out_dir, "preds_vs_preds.eps"), class_names = class_names, percentages = False)
+        transfer_heatmap(preds_vs_preds, os.path.join(out_dir, "percent_preds_vs_preds.eps"), class_names = class_names, annotate = False)
+
+    print("Total: %d" % len(data_x))
+    if data_p is None:
+        print("Correct: %d" % correct)
+        print("Correct / Total: %.3f" % (float(correct) / len(data_x)))
+    else:
+        print("Attacks Succeeded: %d" % (len(data_x) - correct))
+        print("Succeeded / Total: %.3f" % (float(len(data_x) - correct) / len(data_x)))
+        print("Transfers With Matching Predictions: %d" % match)
+        print("Matching / Succeeded: %.3f" % (float(match) / (len(data_x) - correct)))
+    print("Average confidence of correct or matching predictions: %.3f\n" % avg_correct_confidence)
+    print("Average confidence of wrong predictions: %.3f\n" % avg_wrong_confidence)
+
+    if postprocess_fn is not None:
+        no_def_correct = np.sum(no_def_preds == sparse_t)
+        print("Correct / Total without defense: %.3f" % (float(no_def_correct) / len(data_x)))
+        print("Change in Correct / Total from defense: %+.3f" % (float(correct - no_def_correct) / len(data_x)))
+    # timings are only available when the predictions are not cached
+    if time_per_object is not None:
+        print("Time per object without defense: %.3f ms" % (time_per_object * 1000.0))
+    if def_time_per_object is not None:
+        print("Time per object with defense: %.3f ms" % (def_time_per_object * 1000.0))
 
     print("Done!")
 
@@ -599,12 +980,10 @@ def get_feature_vectors(model_path, x_pl, model_loss_fn, data_x_original, data_x
     data_x_original = np.array(data_x_original)
     data_x_adv = np.array(data_x_adv)
 
-    saver = tf.train.Saver()
-
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
     sess = tf.Session(config = config)
-    saver.restore(sess, model_path)
+    restore_model(sess, model_path)
     print("Model restored!")
 
     features_original = []
@@ -663,12 +1042,10 @@ def saliency(model_path, x_pl, model_loss_fn, data_x, class_names, t_pl = None,
     if data_t is not None:
         data_t = np.array(data_t)
 
-    saver = tf.train.Saver()
-
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
     sess = tf.Session(config = config)
-    saver.restore(sess, model_path)
+    restore_model(sess, model_path)
     print("Model restored!")
 
     saliency = []
@@ -0,0 +1,24 @@
+import argparse
+import json
+import socket
+
+def send_requests(socket_path, requests):
+    # sends every request over one connection and returns the responses in order
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    with sock, sock.makefile("rwb") as file:
+        responses = []
+        for request in requests:
+            file.write((json.dumps(request) + "\n").encode())
+            file.flush()
+            responses.append(json.loads(file.readline().decode()))
+    return responses
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sends requests to attack_server.py and prints its responses.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("requests", nargs = "+", help = "JSON requests, like {\"op\": \"attack\", \"input\": \"point_clouds.npz\", \"output\": \"adv.npz\", \"mode\": \"iterative\", \"eps\": 0.01}. The op is one of attack, evaluate, or shutdown.")
+    parser.add_argument("--socket", default = "attack_server.sock", help = "Path of the server's Unix socket.")
+    args = parser.parse_args()
+
+    for response in send_requests(args.socket, [json.loads(request) for request in args.requests]):
+        print(json.dumps(response))
@@ -0,0 +1,214 @@
+import numpy as np
+import tensorflow as tf
+import adversarial_attacks
+import adversarial_utils
+import adversarial_defenses
+import point_cloud_dataset
+import frozen_graph
+import os
+import sys
+import argparse
+import importlib
+import functools
+import json
+import socketserver
+import time
+working_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(working_dir, "models"))
+sys.path.append(os.path.join(working_dir, "utils"))
+
+parser = argparse.ArgumentParser(description = "Long running attack and evaluation server that restores a checkpoint once and keeps the graph for each kind of request. Send it requests with attack_client.py.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--model", choices = ["pointnet", "pointnet2"], default = "pointnet", help = "Which model the checkpoint is for.")
+parser.add_argument("--checkpoint", default = "log/model.ckpt", help = "Path to the model's checkpoint file, or a frozen graph from export_frozen_graph.py. A frozen graph only supports the batch size that it was exported with.")
+parser.add_argument("--class-names", default = "data/modelnet40_ply_hdf5_2048/shape_names.txt", help = "Text file containing a list of class names.")
+parser.add_argument("--num-points", type = int, default = 1024, help = "Number of points to use.")
+parser.add_argument("--batch-size", type = int, default = 1, help = "Number of objects to attack and evaluate at once.")
+parser.add_argument("--socket", default = "attack_server.sock", help = "Path of the Unix socket to listen on.")
+parser.add_argument("--saliency-classes", type = int, default = None, help = "Only differentiate this many of the most likely classes in the saliency defense. Uses every class if not specified.")
+parser.add_argument("--saliency-loss", action = "store_true", help = "Use the gradient of the loss for the predicted class in the saliency defense, which only needs a single backward pass.")
+args = parser.parse_args()
+print(args)
+
+model_names = {
+    "pointnet": "pointnet_cls",
+    "pointnet2": "pointnet2_cls_ssg"
+}
+model = importlib.import_module(model_names[args.model])
+class_names = [line.rstrip() for line in open(args.class_names)]
+
+defense_dict = {
+    "none": None,
+    "outliers": adversarial_defenses.remove_outliers_fn,
+    "saliency": functools.partial(adversarial_defenses.remove_salient_points_fn, num_classes = args.saliency_classes, use_loss = args.saliency_loss)
+}
+
+x_pl, t_pl = model.placeholder_inputs(args.batch_size, args.num_points)
+target_pl = tf.placeholder(tf.int32, shape = [args.batch_size])
+eps_pl = tf.placeholder(tf.float32, shape = [])
+iter_pl = tf.placeholder(tf.int32, shape = [])
+
+is_training = tf.placeholder(tf.bool, shape = [])
+
+if args.checkpoint.endswith(".pb"):
+    # a frozen graph from export_frozen_graph.py, with batch norm folded into the weights
+    model_loss_fn = frozen_graph.load_model_loss_fn(args.checkpoint, args.batch_size, model.get_loss)
+else:
+    def model_loss_fn(x, t):
+        with tf.variable_scope(tf.get_variable_scope(), reuse = tf.AUTO_REUSE):
+            y, end_points = model.get_model(x, is_training, num_classes = len(class_names))
+        if t is None:
+            loss = None
+        else:
+            loss = model.get_loss(y, t, end_points)
+        return y, loss
+
+# the ops for each kind of request are only built the first time that it is requested, and they all share the restored variables
+graphs = {}
+
+def postprocess_op(x, defense):
+    if defense not in defense_dict:
+        raise ValueError("Unknown defense %s!" % defense)
+    if defense_dict[defense] is None:
+        return x
+    return defense_dict[defense](x, model_loss_fn)
+
+def evaluate_ops(defense):
+    key = ("evaluate", defense)
+    if key not in graphs:
+        logits_op, _ = model_loss_fn(postprocess_op(x_pl, defense), None)
+        graphs[key] = [logits_op]
+    return graphs[key]
+
+def attack_ops(mode, norm, defense, targeted):
+    # eps and iter are fed at runtime, and the iterations run in a graph-level loop, so they do not need their own graphs
+    key = ("attack", mode, norm, defense, targeted)
+    if key not in graphs:
+        t = target_pl if targeted else None
+        if mode == "iterative":
+            x_adv_op = adversarial_attacks.iter_grad_op(x_pl, model_loss_fn, t_pl = t, one_hot = False, iter = iter_pl, eps = eps_pl, ord = norm, loop = True)
+        elif mode == "momentum":
+            x_adv_op = adversarial_attacks.momentum_grad_op(x_pl, model_loss_fn, t_pl = t, one_hot = False, iter = iter_pl, eps = eps_pl, ord = norm, loop = True)
+        elif mode == "saliency":
+            x_adv_op = adversarial_attacks.jacobian_saliency_map_points_op(x_pl, model_loss_fn, t_pl = t, one_hot = False, iter = iter_pl, eps = eps_pl, loop = True)
+        elif mode == "saliency_pair":
+            x_adv_op = adversarial_attacks.jacobian_saliency_map_pair_op(x_pl, model_loss_fn, t_pl = t, one_hot = False, iter = iter_pl, eps = eps_pl, loop = True)
+        else:
+            raise ValueError("Only iterative, momentum, saliency, and saliency_pair modes are supported!")
+        x_adv_op = postprocess_op(x_adv_op, defense)
+        logits_adv_op, _ = model_loss_fn(x_adv_op, None)
+        graphs[key] = [x_adv_op, logits_adv_op]
+    return graphs[key]
+
+def read_arrays(file, num_objects):
+    if "x_adv" in file:
+        data_x = file["x_adv"][:num_objects]
+    else:
+        data_x = file["points"][:num_objects, :args.num_points, :]
+    data_t = file["labels"][:num_objects]
+    # only the stable ids from sample_point_clouds.py are passed on, so results without them are joined by their contents
+    data_ids = np.asarray(file["ids"][:num_objects]) if "ids" in file else None
+    return np.asarray(data_x), np.asarray(data_t), data_ids
+
+def read_input(path, num_objects):
+    if point_cloud_dataset.is_dataset(path):
+        return read_arrays(point_cloud_dataset.read_dataset(path), num_objects)
+    with np.load(path) as file:
+        return read_arrays(file, num_objects)
+
+def handle_evaluate(request):
+    data_x, data_t, data_ids = read_input(request["input"], request.get("num_objects"))
+    ops = evaluate_ops(request.get("defense", "none"))
+
+    logits, = adversarial_utils.run_batches(sess, ops, {x_pl: data_x}, args.batch_size, feed_dict = {is_training: False})
+    preds = np.argmax(logits, axis = 1)
+    if "output" in request:
+        arrays = {"logits": logits, "preds": preds, "labels": data_t}
+        if data_ids is not None:
+            arrays["ids"] = data_ids
+        np.savez_compressed(request["output"], **arrays)
+
+    return {"total": len(data_x), "accuracy": float(np.mean(preds == data_t))}
+
+def handle_attack(request):
+    data_x, data_t, data_ids = read_input(request["input"], request.get("num_objects"))
+    total = len(data_x)
+    target = request.get("target")
+    defense = request.get("defense", "none")
+
+    # like the attack scripts, only the objects that the defended model classifies correctly are attacked
+    logits, = adversarial_utils.run_batches(sess, evaluate_ops(defense), {x_pl: data_x}, args.batch_size, feed_dict = {is_training: False})
+    preds = np.argmax(logits, axis = 1)
+    correct_idx = preds == data_t
+    data_x, data_t, preds = data_x[correct_idx], data_t[correct_idx], preds[correct_idx]
+    if len(data_x) == 0:
+        raise ValueError("No objects are classified correctly!")
+
+    ops = attack_ops(request.get("mode", "iterative"), request.get("norm", "inf"), defense, target is not None)
+    batch_feed_dict = {x_pl: data_x}
+    if target is not None:
+        batch_feed_dict[target_pl] = np.repeat(target, len(data_x))
+    x_adv, logits_adv = adversarial_utils.run_batches(sess, ops, batch_feed_dict, args.batch_size, feed_dict = {eps_pl: request.get("eps", 1.0), iter_pl: request.get("iter", 10), is_training: False})
+    preds_adv = np.argmax(logits_adv, axis = 1)
+
+    # the same format as the succeeded point clouds written by the attack scripts
+    if target is None:
+        succeeded_idx = preds_adv != preds
+    else:
+        succeeded_idx = (data_t != target) & (preds_adv == target)
+    arrays = {"x_original": data_x[succeeded_idx], "labels": data_t[succeeded_idx], "x_adv": x_adv[succeeded_idx], "pred_adv": preds_adv[succeeded_idx]}
+    if data_ids is not None:
+        arrays["ids"] = data_ids[correct_idx][succeeded_idx]
+    np.savez_compressed(request["output"], **arrays)
+
+    return {"total": total, "correct": len(data_x), "succeeded": int(np.sum(succeeded_idx))}
+
+handlers = {
+    "evaluate": handle_evaluate,
+    "attack": handle_attack
+}
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    # each line is a JSON request, and each response is a JSON line
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line.decode())
+            start = time.time()
+            if request["op"] == "shutdown":
+                self.server.running = False
+                response = {}
+            elif request["op"] in handlers:
+                try:
+                    response = handlers[request["op"]](request)
+                except Exception as e:
+                    # a bad request should not bring down the server
+                    response = {"error": "%s: %s" % (type(e).__name__, e)}
+            else:
+                response = {"error": "Unknown op %s!" % request["op"]}
+            response["seconds"] = time.time() - start
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+            if not self.server.running:
+                break
+
+# build the clean graph so its variables exist before restoring
+evaluate_ops("none")
+
+config = tf.ConfigProto()
+config.gpu_options.allow_growth = True
+with tf.Session(config = config) as sess:
+    adversarial_utils.restore_model(sess, args.checkpoint)
+    print("Model restored!")
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+
+    # requests are handled one at a time, since they share the session and build ops in the same graph
+    server = socketserver.UnixStreamServer(args.socket, RequestHandler)
+    server.running = True
+    print("Listening on %s" % args.socket)
+    while server.running:
+        server.handle_request()
+    server.server_close()
+    os.remove(args.socket)
+
+print("Done!")
@@ -0,0 +1,91 @@
+import numpy as np
+import tensorflow as tf
+import argparse
+import time
+import adversarial_attacks
+
+parser = argparse.ArgumentParser(description = "Check the blocked pair search of the Jacobian saliency map attack against the exhaustive version.")
+parser.add_argument("--num-points", nargs = "+", type = int, default = [256, 512, 1024], help = "Number of points in each point cloud.")
+parser.add_argument("--batch-size", type = int, default = 8, help = "Number of point clouds in each batch.")
+parser.add_argument("--block-size", type = int, default = 64, help = "Number of rows of the pair saliency matrix that are searched at a time.")
+parser.add_argument("--used", type = float, default = 0.1, help = "Fraction of coordinates that were already perturbed in the random cases.")
+parser.add_argument("--repeats", type = int, default = 10, help = "Number of timed runs for each op.")
+args = parser.parse_args()
+print(args)
+
+np.random.seed(0)
+
+def saliency_pair_exhaustive_op(saliency, target_grad, other_grad, unused, targeted):
+    # the original implementation, which builds the whole size x size pair saliency matrix at once
+    size = tf.shape(saliency)[1]
+    saliency = saliency[:, tf.newaxis, :] + saliency[:, :, tf.newaxis]
+    target_grad = target_grad[:, tf.newaxis, :] + target_grad[:, :, tf.newaxis]
+    other_grad = other_grad[:, tf.newaxis, :] + other_grad[:, :, tf.newaxis]
+
+    if targeted:
+        cond = unused[:, tf.newaxis, :] & unused[:, :, tf.newaxis] & (target_grad >= 0.0) & (other_grad <= 0.0)
+    else:
+        cond = unused[:, tf.newaxis, :] & unused[:, :, tf.newaxis] & (target_grad <= 0.0) & (other_grad >= 0.0)
+
+    diag_zeros = tf.ones([size, size])
+    diag_zeros = tf.linalg.set_diag(diag_zeros, tf.zeros(size))
+
+    idx_both = tf.argmax(tf.reshape(tf.to_float(cond) * diag_zeros[tf.newaxis, :, :] * saliency, [-1, size * size]), axis = 1)
+    i = idx_both // tf.to_int64(size)
+    j = idx_both % tf.to_int64(size)
+
+    return i, j
+
+def cases(size):
+    # gradients for each case, with the coordinates that are still unused
+    shape = (args.batch_size, size)
+    random_unused = np.random.uniform(size = shape) >= args.used
+
+    yield "random", np.random.normal(size = shape), np.random.normal(size = shape), random_unused
+    # few distinct values, so many pairs have the same saliency
+    yield "ties", np.random.randint(-2, 3, size = shape), np.random.randint(-2, 3, size = shape), random_unused
+    yield "all used", np.random.normal(size = shape), np.random.normal(size = shape), np.zeros(shape, dtype = bool)
+    # target and other gradients that are both negative are invalid for both targeted and untargeted attacks
+    yield "no valid pair", -np.abs(np.random.normal(size = shape)), -np.abs(np.random.normal(size = shape)), random_unused
+    yield "zero", np.zeros(shape), np.zeros(shape), random_unused
+
+def benchmark(sess, op, feed_dict):
+    res = sess.run(op, feed_dict = feed_dict) # warm up
+
+    start = time.time()
+    for _ in range(args.repeats):
+        sess.run(op, feed_dict = feed_dict)
+
+    return res, (time.time() - start) / args.repeats
+
+target_grad_pl = tf.placeholder(tf.float32, shape = [args.batch_size, None])
+other_grad_pl = tf.placeholder(tf.float32, shape = [args.batch_size, None])
+unused_pl = tf.placeholder(tf.bool, shape = [args.batch_size, None])
+saliency = tf.abs(target_grad_pl) * tf.abs(other_grad_pl)
+
+ops = []
+for targeted in [False, True]:
+    exhaustive_op = saliency_pair_exhaustive_op(saliency, target_grad_pl, other_grad_pl, unused_pl, targeted)
+    blocked_op = adversarial_attacks.saliency_pair_op(saliency, target_grad_pl, other_grad_pl, unused_pl, targeted, block_size = args.block_size)
+    ops.append((targeted, exhaustive_op, blocked_op))
+
+config = tf.ConfigProto()
+config.gpu_options.allow_growth = True
+with tf.Session(config = config) as sess:
+    print("Points, Case, Targeted, Exhaustive Time (s), Blocked Time (s), Mismatched Pairs")
+
+    mismatches = 0
+    for num_points in args.num_points:
+        for name, target_grad, other_grad, unused in cases(num_points * 3):
+            feed_dict = {target_grad_pl: target_grad, other_grad_pl: other_grad, unused_pl: unused}
+
+            for targeted, exhaustive_op, blocked_op in ops:
+                (exhaustive_i, exhaustive_j), exhaustive_time = benchmark(sess, exhaustive_op, feed_dict)
+                (blocked_i, blocked_j), blocked_time = benchmark(sess, blocked_op, feed_dict)
+
+                mismatched = np.sum((exhaustive_i != blocked_i) | (exhaustive_j != blocked_j))
+                mismatches += mismatched
+                print("%d, %s, %s, %.4f, %.4f, %d" % (num_points, name, targeted, exhaustive_time, blocked_time, mismatched))
+
+    if mismatches > 0:
+        raise ValueError("The blocked pair search picked %d pairs that are different from the exhaustive search!" % mismatches)
@@ -0,0 +1,75 @@
+import numpy as np
+import tensorflow as tf
+import argparse
+import time
+import adversarial_defenses
+
+parser = argparse.ArgumentParser(description = "Benchmark the outlier removal defense against the dense distance matrix version.")
+parser.add_argument("--num-points", nargs = "+", type = int, default = [1024, 2048, 4096], help = "Number of points in each point cloud.")
+parser.add_argument("--batch-size", type = int, default = 8, help = "Number of point clouds in each batch.")
+parser.add_argument("--top-k", type = int, default = 10, help = "Number of nearest neighbors for each point.")
+parser.add_argument("--num-std", type = float, default = 1.0, help = "Number of standard deviations above the mean distance for a point to be removed.")
+parser.add_argument("--chunk-size", type = int, default = 256, help = "Number of rows of the distance matrix that are computed at a time.")
+parser.add_argument("--repeats", type = int, default = 10, help = "Number of timed runs for each op.")
+args = parser.parse_args()
+print(args)
+
+np.random.seed(0)
+
+def remove_outliers_dense_fn(x, model_loss_fn, top_k = 10, num_std = 1.0):
+    # the original implementation, which builds the whole distance matrix at once
+    dists = x[:, tf.newaxis] - x[:, :, tf.newaxis]
+    dists = tf.linalg.norm(dists, axis = 3)
+
+    diag = tf.eye(tf.shape(x)[1], batch_shape = [tf.shape(x)[0]])
+    dists = tf.where(diag > 0.0, tf.fill(tf.shape(dists), float("inf")), dists)
+    dists = tf.nn.top_k(dists * -1.0, k = top_k, sorted = False)[0] * -1.0
+
+    dists = tf.reduce_mean(dists, axis = 2)
+    avg, var = tf.nn.moments(dists, axes = [1], keep_dims = True)
+    std = num_std * tf.sqrt(var)
+
+    remove = dists > avg + std
+    idx = tf.argmin(tf.to_float(remove), axis = 1)
+    one_hot = tf.one_hot(idx, tf.shape(x)[1])
+    replace = tf.reduce_sum(x * one_hot[:, :, tf.newaxis], axis = 1, keep_dims = True)
+    x = tf.where(remove[:, :, tf.newaxis] & tf.fill(tf.shape(x), True), replace + tf.zeros_like(x), x)
+
+    return tf.stop_gradient(x)
+
+def peak_bytes(run_metadata):
+    # largest peak memory usage over all allocators
+    peaks = {}
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for mem in node_stats.memory:
+                peaks[mem.allocator_name] = max(peaks.get(mem.allocator_name, 0), mem.peak_bytes)
+    return max(peaks.values()) if peaks else 0
+
+def benchmark(sess, op, feed_dict):
+    run_options = tf.RunOptions(trace_level = tf.RunOptions.FULL_TRACE)
+    run_metadata = tf.RunMetadata()
+    res = sess.run(op, feed_dict = feed_dict, options = run_options, run_metadata = run_metadata) # warm up
+
+    start = time.time()
+    for _ in range(args.repeats):
+        sess.run(op, feed_dict = feed_dict)
+
+    return res, (time.time() - start) / args.repeats, peak_bytes(run_metadata)
+
+x_pl = tf.placeholder(tf.float32, shape = [args.batch_size, None, 3])
+dense_op = remove_outliers_dense_fn(x_pl, None, top_k = args.top_k, num_std = args.num_std)
+knn_op = adversarial_defenses.remove_outliers_fn(x_pl, None, top_k = args.top_k, num_std = args.num_std, chunk_size = args.chunk_size)
+
+config = tf.ConfigProto()
+config.gpu_options.allow_growth = True
+with tf.Session(config = config) as sess:
+    print("Points, Dense Time (s), Dense Memory (MB), KNN Time (s), KNN Memory (MB), Max Difference")
+
+    for num_points in args.num_points:
+        data_x = np.random.uniform(-1.0, 1.0, size = (args.batch_size, num_points, 3)).astype(np.float32)
+
+        x_dense, dense_time, dense_bytes = benchmark(sess, dense_op, {x_pl: data_x})
+        x_knn, knn_time, knn_bytes = benchmark(sess, knn_op, {x_pl: data_x})
+
+        print("%d, %.4f, %.1f, %.4f, %.1f, %g" % (num_points, dense_time, dense_bytes / 2.0 ** 20, knn_time, knn_bytes / 2.0 ** 20, np.max(np.abs(x_dense - x_knn))))
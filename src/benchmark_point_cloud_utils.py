@@ -0,0 +1,52 @@
+import numpy as np
+import argparse
+import glob
+import os
+import time
+import point_cloud_utils
+
+parser = argparse.ArgumentParser(description = "Benchmark the mesh loading and point cloud sampling utilities.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--data", default = "objects/*/test/*.off", help = "Glob path of the OFF files to load.")
+parser.add_argument("--num-objects", type = int, default = 1000000000, help = "Use the first few objects. Specify a very large number to use all objects.")
+parser.add_argument("--benchmarks", nargs = "+", choices = ["read_off", "farthest_points"], default = ["read_off", "farthest_points"], help = "Which benchmarks to run.")
+parser.add_argument("--fps-objects", type = int, default = 64, help = "Number of random point clouds for the farthest point sampling benchmark.")
+parser.add_argument("--fps-input-points", type = int, default = 10000, help = "Number of points in each point cloud before farthest point sampling.")
+parser.add_argument("--fps-output-points", type = int, default = 2048, help = "Number of points in each point cloud after farthest point sampling.")
+parser.add_argument("--fps-batch-size", type = int, default = 64, help = "Number of objects that are sampled at once.")
+args = parser.parse_args()
+print(args)
+
+def benchmark_read_off_file():
+    paths = sorted(glob.glob(args.data))[:args.num_objects]
+    if len(paths) == 0:
+        raise ValueError("No OFF files match the data path!")
+
+    num_bytes = sum(os.path.getsize(path) for path in paths)
+
+    start = time.time()
+    num_faces = 0
+    for path in paths:
+        num_faces += len(point_cloud_utils.read_off_file(path))
+    elapsed = time.time() - start
+
+    print("Loaded %d objects with %d faces in %.3f s" % (len(paths), num_faces, elapsed))
+    print("Objects per second: %.1f" % (len(paths) / elapsed))
+    print("Faces per second: %.1f" % (num_faces / elapsed))
+    print("MB per second: %.1f" % (num_bytes / 2.0 ** 20 / elapsed))
+
+def benchmark_farthest_points():
+    np.random.seed(0)
+    points = np.random.uniform(-1.0, 1.0, size = (args.fps_objects, args.fps_input_points, 3))
+    faces = np.random.uniform(-1.0, 1.0, size = (args.fps_objects, args.fps_input_points, 3, 3))
+
+    start = time.time()
+    point_cloud_utils.farthest_points_normalized(points, faces, args.fps_output_points, batch_size = args.fps_batch_size)
+    elapsed = time.time() - start
+
+    print("Sampled %d to %d points for %d objects in %.3f s" % (args.fps_input_points, args.fps_output_points, args.fps_objects, elapsed))
+    print("Objects per second: %.1f" % (args.fps_objects / elapsed))
+
+if "read_off" in args.benchmarks:
+    benchmark_read_off_file()
+if "farthest_points" in args.benchmarks:
+    benchmark_farthest_points()
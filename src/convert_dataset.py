@@ -0,0 +1,41 @@
+import numpy as np
+import argparse
+import point_cloud_dataset
+
+parser = argparse.ArgumentParser(description = "Converts point clouds to the memory mapped dataset format.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--data", default = "point_clouds.npz", help = "Input data. Either a Numpy file or a text file containing a list of HDF5 files.")
+parser.add_argument("--output", default = "point_clouds", help = "Output dataset directory.")
+args = parser.parse_args()
+print(args)
+
+if args.data.endswith(".npz"):
+    with np.load(args.data) as file:
+        point_cloud_dataset.write_dataset(args.output, **{name: file[name] for name in file.files})
+else:
+    import h5py
+
+    paths = [line.rstrip() for line in open(args.data) if line.strip()]
+
+    shapes = []
+    for path in paths:
+        with h5py.File(path, "r") as file:
+            shapes.append(file["data"].shape)
+    total = sum(shape[0] for shape in shapes)
+
+    dataset = point_cloud_dataset.create_dataset(args.output, {
+        "points": (np.float32, (total,) + shapes[0][1:]),
+        "labels": (np.int64, (total,))
+    })
+
+    # copy one HDF5 file at a time
+    start = 0
+    for path, shape in zip(paths, shapes):
+        with h5py.File(path, "r") as file:
+            dataset["points"][start:start + shape[0]] = file["data"][:]
+            dataset["labels"][start:start + shape[0]] = np.squeeze(file["label"][:])
+        start += shape[0]
+
+    for arr in dataset.values():
+        arr.flush()
+
+print("Done!")
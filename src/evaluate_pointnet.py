@@ -1,34 +1,52 @@
 import numpy as np
 import tensorflow as tf
 import adversarial_utils
+import point_cloud_dataset
+import frozen_graph
+import adversarial_defenses
 import os
 import sys
 import argparse
 import importlib
+import functools
 working_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(working_dir, "models"))
 sys.path.append(os.path.join(working_dir, "utils"))
 import provider
 
 parser = argparse.ArgumentParser(description = "Evaluates PointNet on classification.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("--checkpoint", default = "log/model.ckpt", help = "Path to the model's checkpoint file.")
+parser.add_argument("--checkpoint", default = "log/model.ckpt", help = "Path to the model's checkpoint file, or a frozen graph from export_frozen_graph.py. A frozen graph only supports the batch size that it was exported with.")
 parser.add_argument("--output", default = "evaluate", help = "Output directory.")
-parser.add_argument("--data", default = "data/modelnet40_ply_hdf5_2048/test_files.txt", help = "Input data. Either a Numpy file or a text file containing a list of HDF5 files.")
+parser.add_argument("--data", default = "data/modelnet40_ply_hdf5_2048/test_files.txt", help = "Input data. Either a Numpy file, a dataset directory, or a text file containing a list of HDF5 files.")
 parser.add_argument("--class-names", default = "data/modelnet40_ply_hdf5_2048/shape_names.txt", help = "Text file containing a list of class names.")
 parser.add_argument("--num-points", type = int, default = 1024, help = "Number of points to use.")
 parser.add_argument("--sparse-target", type = int, default = None, help = "Sparse adversarial attack target.")
 parser.add_argument("--num-objects", type = int, default = 1000000000, help = "Use the first few objects. Specify a very large number to use all objects.")
+parser.add_argument("--defense", choices = ["none", "outliers", "saliency"], default = "none", help = "Which algorithm to use for postprocessing points as a defense.")
+parser.add_argument("--saliency-classes", type = int, default = None, help = "Only differentiate this many of the most likely classes in the saliency defense. Uses every class if not specified.")
+parser.add_argument("--saliency-loss", action = "store_true", help = "Use the gradient of the loss for the predicted class in the saliency defense, which only needs a single backward pass.")
+parser.add_argument("--batch-size", type = int, default = 1, help = "Number of objects to evaluate at once.")
+parser.add_argument("--clean-cache", default = None, help = "Directory for caching clean predictions between runs. Disabled if not specified.")
 args = parser.parse_args()
 print(args)
 
 model = importlib.import_module("pointnet_cls")
 class_names = [line.rstrip() for line in open(args.class_names)]
 
+if args.checkpoint.endswith(".pb"):
+    # loaded before the data, so a batch size that the frozen graph was not exported with fails early
+    model_loss_fn = frozen_graph.load_model_loss_fn(args.checkpoint, args.batch_size, model.get_loss)
+
 numpy_file = args.data.endswith(".npz")
 
 data_p = None
 
-if numpy_file:
+if point_cloud_dataset.is_dataset(args.data):
+    # memory mapped, so slicing does not load or copy the whole dataset
+    dataset = point_cloud_dataset.read_dataset(args.data)
+    data_x = dataset["points"][:, :args.num_points, :]
+    data_t = dataset["labels"]
+elif numpy_file:
     with np.load(args.data) as file:
         if "x_adv" in file:
             data_x = file["x_adv"]
@@ -58,17 +76,24 @@ data_t = data_t[:args.num_objects]
 if data_p is not None:
     data_p = data_p[:args.num_objects]
 
-x_pl, t_pl = model.placeholder_inputs(1, args.num_points)
+x_pl, t_pl = model.placeholder_inputs(args.batch_size, args.num_points)
 
 is_training = tf.placeholder(tf.bool, shape = [])
 
-def model_loss_fn(x, t):
-    with tf.variable_scope(tf.get_variable_scope(), reuse = tf.AUTO_REUSE):
-        y, end_points = model.get_model(x, is_training, num_classes = len(class_names))
-    if t is None:
-        loss = None
-    else:
-        loss = model.get_loss(y, t, end_points)
-    return y, loss
+if not args.checkpoint.endswith(".pb"):
+    def model_loss_fn(x, t):
+        with tf.variable_scope(tf.get_variable_scope(), reuse = tf.AUTO_REUSE):
+            y, end_points = model.get_model(x, is_training, num_classes = len(class_names))
+        if t is None:
+            loss = None
+        else:
+            loss = model.get_loss(y, t, end_points)
+        return y, loss
+
+defense_dict = {
+    "none": None,
+    "outliers": adversarial_defenses.remove_outliers_fn,
+    "saliency": functools.partial(adversarial_defenses.remove_salient_points_fn, num_classes = args.saliency_classes, use_loss = args.saliency_loss)
+}
 
-adversarial_utils.evaluate(args.checkpoint, args.output, x_pl, t_pl, model_loss_fn, data_x, data_t, class_names, data_p = data_p, one_hot = False, extra_feed_dict = {is_training: False})
\ No newline at end of file
+adversarial_utils.evaluate(args.checkpoint, args.output, x_pl, t_pl, model_loss_fn, data_x, data_t, class_names, data_p = data_p, one_hot = False, extra_feed_dict = {is_training: False}, batch_size = args.batch_size, clean_cache_dir = args.clean_cache, postprocess_fn = defense_dict[args.defense])
\ No newline at end of file
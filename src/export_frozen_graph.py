@@ -0,0 +1,52 @@
+import tensorflow as tf
+import frozen_graph
+import os
+import sys
+import argparse
+import importlib
+working_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(working_dir, "models"))
+sys.path.append(os.path.join(working_dir, "utils"))
+
+parser = argparse.ArgumentParser(description = "Exports a frozen inference graph, with batch norm folded into the weights and the training ops removed. Pass it as the checkpoint of the attack and evaluation scripts.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--model", choices = ["pointnet", "pointnet2"], default = "pointnet", help = "Which model the checkpoint is for.")
+parser.add_argument("--checkpoint", default = "log/model.ckpt", help = "Path to the model's checkpoint file.")
+parser.add_argument("--output", default = "log/frozen_model.pb", help = "Output frozen graph file.")
+parser.add_argument("--class-names", default = "data/modelnet40_ply_hdf5_2048/shape_names.txt", help = "Text file containing a list of class names.")
+parser.add_argument("--num-points", type = int, default = 1024, help = "Number of points to use.")
+parser.add_argument("--batch-size", type = int, default = 1, help = "Number of objects in each batch. The models use a fixed batch size, so the scripts that load the frozen graph must use the same batch size.")
+args = parser.parse_args()
+print(args)
+
+model_names = {
+    "pointnet": "pointnet_cls",
+    "pointnet2": "pointnet2_cls_ssg"
+}
+model = importlib.import_module(model_names[args.model])
+class_names = [line.rstrip() for line in open(args.class_names)]
+
+x_pl = tf.placeholder(tf.float32, shape = [args.batch_size, args.num_points, 3], name = frozen_graph.input_name)
+# a constant lets batch norm and dropout pick their inference branches when the graph is built
+is_training = tf.constant(False)
+logits, end_points = model.get_model(x_pl, is_training, num_classes = len(class_names))
+tf.identity(logits, name = frozen_graph.logits_name)
+# the end points are kept, since the model's loss can regularize them
+output_names = [frozen_graph.logits_name]
+for name, end_point in sorted(end_points.items()):
+    tf.identity(end_point, name = frozen_graph.end_point_prefix + name)
+    output_names.append(frozen_graph.end_point_prefix + name)
+
+saver = tf.train.Saver()
+
+with tf.Session() as sess:
+    saver.restore(sess, args.checkpoint)
+    print("Model restored!")
+
+    graph_def = frozen_graph.freeze_graph(sess, output_names)
+
+output_dir = os.path.dirname(args.output)
+if output_dir and not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+frozen_graph.write_graph(args.output, graph_def)
+
+print("Exported %d ops to %s" % (len(graph_def.node), args.output))
@@ -0,0 +1,25 @@
+import visualization_utils
+import argparse
+import os
+import sys
+working_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(working_dir, "utils"))
+import pc_util
+
+parser = argparse.ArgumentParser(description = "Writes the original and adversarial point clouds of an attack's results as PLY files.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--results", default = "adversarial/succeeded_point_clouds_eps_1_0.npz", help = "Numpy file of attack results.")
+parser.add_argument("--output", default = "ply", help = "Output directory.")
+parser.add_argument("--text", action = "store_true", help = "Write ASCII PLY files instead of binary PLY files.")
+args = parser.parse_args()
+print(args)
+
+if not os.path.exists(args.output):
+    os.makedirs(args.output)
+
+results = visualization_utils.read_results(args.results)
+for name, suffix in [("x_original", "original"), ("x_adv", "adv")]:
+    points = results[name]
+    pc_util.write_ply_batch(points, [os.path.join(args.output, "%d_%s.ply" % (i, suffix)) for i in range(len(points))], text = args.text)
+    print("Wrote %d %s point clouds" % (len(points), suffix))
+
+print("Done!")
@@ -0,0 +1,99 @@
+import tensorflow as tf
+
+# names of the input and output tensors in exported graphs
+input_name = "points"
+logits_name = "logits"
+# the model's end points are exported with this prefix, so the loss can use them
+end_point_prefix = "end_point_"
+
+def freeze_graph(sess, output_names):
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    graph_def = tf.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), output_names)
+    # constant folding does not remove conds, and removing the Identity nodes would break their pivots, so the graph has to be built without any
+    conds = sorted(node.name for node in graph_def.node if node.op in ["Switch", "Merge"])
+    if conds:
+        raise ValueError("The graph still has control flow in %s, so build it with a constant is_training!" % ", ".join(conds[:5]))
+    # keep the input's shape, so the batch size that the graph was exported with can be read back
+    shape = ",".join(str(dim) for dim in sess.graph.get_tensor_by_name(input_name + ":0").shape.as_list())
+    # batch norm is folded into the weights of the layer before it
+    transforms = [
+        "strip_unused_nodes(type=float, shape=\"%s\")" % shape,
+        "remove_nodes(op=Identity, op=CheckNumerics)",
+        "fold_constants(ignore_errors=true)",
+        "fold_batch_norms",
+        "fold_old_batch_norms",
+        "fold_constants(ignore_errors=true)",
+        "sort_by_execution_order"
+    ]
+    return TransformGraph(graph_def, [input_name], output_names, transforms)
+
+def write_graph(path, graph_def):
+    with open(path, "wb") as f:
+        f.write(graph_def.SerializeToString())
+
+def read_graph(path):
+    graph_def = tf.GraphDef()
+    with open(path, "rb") as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+def batch_size(graph_def):
+    for node in graph_def.node:
+        if node.name == input_name:
+            dims = node.attr["shape"].shape.dim
+            if len(dims) == 0 or dims[0].size < 0:
+                raise ValueError("The frozen graph does not record its batch size, so it needs to be exported again!")
+            return dims[0].size
+    raise ValueError("The frozen graph has no %s input!" % input_name)
+
+def check_batch_size(graph_def, size):
+    # the models use a fixed batch size, so the graph can only be fed batches of the size that it was exported with
+    exported_size = batch_size(graph_def)
+    if exported_size != size:
+        raise ValueError("The frozen graph was exported with a batch size of %d, but the batch size is %d!" % (exported_size, size))
+
+def model_loss_fn(graph_def, get_loss):
+    # the returned function can be used in place of the model_loss_fn of the attack and evaluation scripts
+    end_point_names = [node.name[len(end_point_prefix):] for node in graph_def.node if node.name.startswith(end_point_prefix)]
+
+    # the weights are replaced by placeholders, so every import shares one copy of them instead of adding its own
+    stripped_graph_def = tf.GraphDef()
+    weights = {}
+    for node in graph_def.node:
+        if node.op == "Const" and node.attr["dtype"].type == tf.float32.as_datatype_enum:
+            weights[node.name] = tf.make_ndarray(node.attr["value"].tensor)
+            placeholder = stripped_graph_def.node.add()
+            placeholder.name = node.name
+            placeholder.op = "Placeholder"
+            placeholder.attr["dtype"].CopyFrom(node.attr["dtype"])
+            placeholder.attr["shape"].shape.CopyFrom(node.attr["value"].tensor.tensor_shape)
+        else:
+            stripped_graph_def.node.add().CopyFrom(node)
+    stripped_graph_def.library.CopyFrom(graph_def.library)
+    stripped_graph_def.versions.CopyFrom(graph_def.versions)
+
+    weight_ops = {}
+    def fn(x, t):
+        if not weight_ops:
+            # like the model's variables, the weights are created by the first call, which cannot be inside of a loop
+            for name, value in weights.items():
+                weight_ops[name + ":0"] = tf.constant(value, name = "frozen_weights/" + name)
+        input_map = dict(weight_ops)
+        input_map[input_name + ":0"] = x
+        # the input is replaced by x so gradients flow back to it
+        outputs = tf.import_graph_def(stripped_graph_def, input_map = input_map, return_elements = [logits_name + ":0"] + [end_point_prefix + name + ":0" for name in end_point_names], name = "frozen")
+        logits = outputs[0]
+        if t is None:
+            loss = None
+        else:
+            # the same loss as the checkpoint, including any regularization of the end points
+            loss = get_loss(logits, t, dict(zip(end_point_names, outputs[1:])))
+        return logits, loss
+
+    return fn
+
+def load_model_loss_fn(path, batch_size, get_loss):
+    graph_def = read_graph(path)
+    check_batch_size(graph_def, batch_size)
+    return model_loss_fn(graph_def, get_loss)
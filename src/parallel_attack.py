@@ -0,0 +1,71 @@
+import numpy as np
+import adversarial_utils
+import result_writer
+import argparse
+import glob
+import multiprocessing
+import os
+import subprocess
+import sys
+
+parser = argparse.ArgumentParser(description = "Splits the correct objects of an adversarial attack across worker processes that each have their own TensorFlow session, and merges their results. Any other arguments are passed to the attack script.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--script", default = "adversarial_pointnet.py", help = "Attack script that each worker runs.")
+parser.add_argument("--output", default = "adversarial", help = "Output directory. Each worker writes to its own subdirectory.")
+parser.add_argument("--class-names", default = "data/modelnet40_ply_hdf5_2048/shape_names.txt", help = "Text file containing a list of class names.")
+parser.add_argument("--workers", type = int, default = 4, help = "Number of worker processes.")
+parser.add_argument("--intra-op-threads", type = int, default = 0, help = "Number of threads used within each TensorFlow op in each worker. Uses the number of cores divided by the number of workers if 0.")
+parser.add_argument("--inter-op-threads", type = int, default = 1, help = "Number of TensorFlow ops run at once in each worker.")
+parser.add_argument("--clean-cache", default = None, help = "Directory for caching clean predictions, which are computed once before starting the workers. Uses a clean_cache subdirectory of the output directory if not specified.")
+args, attack_args = parser.parse_known_args()
+print(args)
+
+working_dir = os.path.dirname(os.path.abspath(__file__))
+intra_op_threads = args.intra_op_threads if args.intra_op_threads > 0 else max(multiprocessing.cpu_count() // args.workers, 1)
+class_names = [line.rstrip() for line in open(args.class_names)]
+worker_dirs = [os.path.join(args.output, "worker_%d" % i) for i in range(args.workers)]
+clean_cache = args.clean_cache if args.clean_cache is not None else os.path.join(args.output, "clean_cache")
+
+# run the clean pass once with every core, so the workers only read its cached predictions instead of each repeating it and racing to write the cache
+print("Computing clean predictions...")
+subprocess.check_call([sys.executable, os.path.join(working_dir, args.script), "--output", args.output, "--class-names", args.class_names, "--clean-cache", clean_cache, "--clean-only"] + attack_args)
+
+processes = []
+for i in range(args.workers):
+    command = [sys.executable, os.path.join(working_dir, args.script), "--output", worker_dirs[i], "--class-names", args.class_names, "--clean-cache", clean_cache, "--worker", str(i), "--num-workers", str(args.workers), "--intra-op-threads", str(intra_op_threads), "--inter-op-threads", str(args.inter_op_threads)] + attack_args
+    # keep OpenMP from starting a thread for every core in every worker
+    env = dict(os.environ, OMP_NUM_THREADS = str(intra_op_threads))
+    processes.append((command, subprocess.Popen(command, env = env)))
+
+for command, process in processes:
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+print("Merging results...")
+
+# each worker attacked a contiguous share of the correct objects, so concatenating in worker order gives the same order as a single process
+for path in sorted(glob.glob(os.path.join(worker_dirs[0], "succeeded_point_clouds_*.npz"))):
+    name = os.path.basename(path)
+    writer = result_writer.ResultWriter(os.path.join(args.output, name))
+    for worker_dir in worker_dirs:
+        with np.load(os.path.join(worker_dir, name)) as file:
+            writer.append(**{k: file[k] for k in file.files})
+    writer.close()
+
+for path in sorted(glob.glob(os.path.join(worker_dirs[0], "worker_stats_eps_*.npz"))):
+    name = os.path.basename(path)
+    eps_str = name[len("worker_stats_eps_"):-len(".npz")]
+
+    stats = []
+    for worker_dir in worker_dirs:
+        with np.load(os.path.join(worker_dir, name)) as file:
+            stats.append({k: file[k] for k in file.files})
+    # the objects are on the last axis, since targeted attacks have one row for each target class
+    merged = {k: np.concatenate([curr_stats[k] for curr_stats in stats], axis = -1) for k in ["preds", "confidences", "preds_adv", "confidences_adv", "iters"]}
+    iters = merged["iters"] if stats[0]["early_stop"] else None
+
+    if merged["preds_adv"].ndim == 2:
+        adversarial_utils.write_targeted_stats(args.output, eps_str, class_names, stats[0]["total"], merged["preds"], merged["confidences"], merged["preds_adv"], merged["confidences_adv"], iters = iters)
+    else:
+        adversarial_utils.write_untargeted_stats(args.output, eps_str, class_names, stats[0]["total"], stats[0]["class_totals"], merged["preds"], merged["confidences"], merged["preds_adv"], merged["confidences_adv"], iters = iters)
+
+print("Done!")
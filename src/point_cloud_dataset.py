@@ -0,0 +1,35 @@
+import numpy as np
+import json
+import os
+
+# a dataset is a directory with one uncompressed binary file per array and a JSON header with their dtypes and shapes
+header_name = "header.json"
+
+def is_dataset(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, header_name))
+
+def create_dataset(path, specs):
+    # specs maps each array name to its (dtype, shape), and writable memory maps are returned so that arrays can be filled in pieces
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    header = {}
+    for name, (dtype, shape) in specs.items():
+        header[name] = {"dtype": np.dtype(dtype).str, "shape": [int(x) for x in shape]}
+    with open(os.path.join(path, header_name), "w") as f:
+        json.dump(header, f, indent = 4)
+
+    return {name: np.memmap(os.path.join(path, name + ".bin"), dtype = header[name]["dtype"], mode = "w+", shape = tuple(header[name]["shape"])) for name in header}
+
+def write_dataset(path, **arrays):
+    res = create_dataset(path, {name: (arr.dtype, arr.shape) for name, arr in arrays.items()})
+    for name, arr in arrays.items():
+        res[name][...] = arr
+        res[name].flush()
+
+def read_dataset(path, mode = "r"):
+    # slicing the returned arrays does not read or copy the rest of the dataset
+    with open(os.path.join(path, header_name)) as f:
+        header = json.load(f)
+
+    return {name: np.memmap(os.path.join(path, name + ".bin"), dtype = spec["dtype"], mode = mode, shape = tuple(spec["shape"])) for name, spec in header.items()}
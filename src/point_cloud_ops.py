@@ -0,0 +1,32 @@
+import tensorflow as tf
+
+def knn_dists_op(x, k = 1, chunk_size = 256):
+    # distances from each point to its k nearest neighbors (excluding itself)
+    # only chunk_size rows of the distance matrix are built at a time, so memory grows linearly with the number of points
+    batch_size = tf.shape(x)[0]
+    num_points = tf.shape(x)[1]
+    num_chunks = (num_points + chunk_size - 1) // chunk_size
+
+    padded = tf.pad(x, [[0, 0], [0, num_chunks * chunk_size - num_points], [0, 0]])
+    chunks = tf.reshape(padded, [batch_size, num_chunks, chunk_size, 3])
+    chunks = tf.transpose(chunks, [1, 0, 2, 3])
+
+    def chunk_fn(args):
+        i, chunk = args
+        dists = x[:, tf.newaxis] - chunk[:, :, tf.newaxis]
+        dists = tf.linalg.norm(dists, axis = 3)
+
+        # the distance from a point to itself does not count
+        rows = i * chunk_size + tf.range(chunk_size)
+        diag = tf.equal(rows[:, tf.newaxis], tf.range(num_points)[tf.newaxis, :])
+        diag = diag[tf.newaxis, :, :] & tf.fill(tf.shape(dists), True)
+        dists = tf.where(diag, tf.fill(tf.shape(dists), float("inf")), dists)
+
+        return tf.nn.top_k(dists * -1.0, k = k, sorted = False)[0] * -1.0
+
+    # one chunk at a time to bound the peak memory
+    dists = tf.map_fn(chunk_fn, (tf.range(num_chunks), chunks), dtype = x.dtype, parallel_iterations = 1)
+    dists = tf.transpose(dists, [1, 0, 2, 3])
+    dists = tf.reshape(dists, [batch_size, num_chunks * chunk_size, k])
+
+    return dists[:, :num_points]
@@ -1,7 +1,53 @@
 import glob
 import os
 import numpy as np
-import bisect
+
+def read_off_file(path):
+    with open(path) as file:
+        lines = [line for line in file.read().split("\n") if line.strip()]
+
+    header = lines[0].strip()
+    if len(header) > 3:
+        counts = header[3:] # exclude 'OFF'
+        lines = lines[1:]
+    else:
+        counts = lines[1]
+        lines = lines[2:]
+    num_vertices, num_faces = [int(x) for x in counts.split()[:2]]
+
+    vertices = np.fromstring(" ".join(lines[:num_vertices]), sep = " ")
+    vertices = vertices.reshape((num_vertices, -1))[:, :3]
+
+    face_lines = lines[num_vertices:num_vertices + num_faces]
+    idx = np.fromstring(" ".join(face_lines), sep = " ", dtype = int)
+    if len(idx) == num_faces * 4 and np.all(idx[::4] == 3):
+        # fast path for meshes that only have triangles
+        idx = idx.reshape((num_faces, 4))[:, 1:]
+    else:
+        # split polygons into triangle fans around their first vertex
+        triangles = []
+        for line in face_lines:
+            poly = np.fromstring(line, sep = " ", dtype = int)
+            poly = poly[1:poly[0] + 1]
+            triangles.append(np.stack([np.repeat(poly[0], len(poly) - 2), poly[1:-1], poly[2:]], axis = 1))
+        idx = np.concatenate(triangles) if triangles else np.zeros(shape = (0, 3), dtype = int)
+
+    return vertices[idx] # the shape is (num_faces, 3, 3)
+
+def read_off_object(path, label_names = None):
+    # label_names maps each class name to its index
+    faces = read_off_file(path)
+    if faces.ndim == 3 and faces.shape[1:] == (3, 3):
+        name = os.path.basename(path)
+        name = name[:name.rindex("_")]
+        if label_names is None or name in label_names:
+            if label_names is not None:
+                name = label_names[name]
+            return faces[:, :, [0, 2, 1]], name
+        else:
+            raise ValueError("A label does not exist in label names!")
+    else:
+        raise ValueError("A 3D object's array has incorrect shape!")
 
 def read_off_files(globPath, label_names = None):
     if label_names is not None:
@@ -10,102 +56,80 @@ def read_off_files(globPath, label_names = None):
     objects = []
     labels = []
     for path in glob.glob(globPath):
-        with open(path) as file:
-            line = file.readline()
-            if len(line) > 4:
-                line = line[3:] # exclude 'OFF'
-            else:
-                line = file.readline()
-            num_vertices, num_faces, _ = [int(x) for x in line.split()]
-
-            vertices = []
-            for _ in range(num_vertices):
-                vertices.append([float(x) for x in file.readline().split()])
-            
-            faces = []
-            for _ in range(num_faces):
-                curr_face = []
-                idx = [int(x) for x in file.readline().split()]
-                idx = idx[1:]
-                for i in idx:
-                    curr_face.append(vertices[i])
-                faces.append(curr_face)
-            
-            faces = np.array(faces) # the shape should be (num_faces, 3, 3)
-            if tuple(faces.shape) == (num_faces, 3, 3):
-                name = os.path.basename(path)
-                name = name[:name.rindex("_")]
-                if label_names is None or name in label_names:
-                    if label_names is not None:
-                        name = label_names[name]
-                    objects.append(faces[:, :, [0, 2, 1]])
-                    labels.append(name)
-                else:
-                    raise ValueError("A label does not exist in label names!")
-            else:
-                raise ValueError("A 3D object's array has incorrect shape!")
+        faces, name = read_off_object(path, label_names)
+        objects.append(faces)
+        labels.append(name)
     
     return objects, np.array(labels)
 
 def sample_points(objects, num_points):
-    points = []
-    triangles = []
-
-    for obj in objects:
-        curr_points = []
-        curr_triangles = []
+    points = np.empty(shape = (len(objects), num_points, 3))
+    triangles = np.empty(shape = (len(objects), num_points, 3, 3))
 
+    for i, obj in enumerate(objects):
         areas = np.cross(obj[:, 1] - obj[:, 0], obj[:, 2] - obj[:, 0])
         areas = np.linalg.norm(areas, axis = 1) / 2.0
         prefix_sum = np.cumsum(areas)
         total_area = prefix_sum[-1]
-        
-        for _ in range(num_points):
-            # pick random triangle based on area
-            rand = np.random.uniform(high = total_area)
-            if rand >= total_area:
-                idx = len(obj) - 1 # can happen due to floating point rounding
-            else:
-                idx = bisect.bisect_right(prefix_sum, rand)
-            
-            # pick random point in triangle
-            a, b, c = obj[idx]
-            r1 = np.random.random()
-            r2 = np.random.random()
-            if r1 + r2 >= 1.0:
-                r1 = 1 - r1
-                r2 = 1 - r2
-            p = a + r1 * (b - a) + r2 * (c - a)
-
-            curr_points.append(p)
-            curr_triangles.append(obj[idx])
-
-        points.append(curr_points)
-        triangles.append(curr_triangles)
-    
-    points = np.array(points)
-    triangles = np.array(triangles)
+
+        # pick random triangles based on area
+        rand = np.random.uniform(high = total_area, size = num_points)
+        idx = np.searchsorted(prefix_sum, rand, side = "right")
+        idx = np.minimum(idx, len(obj) - 1) # can happen due to floating point rounding
+
+        # pick random points in the triangles
+        a, b, c = np.transpose(obj[idx], axes = (1, 0, 2))
+        r1 = np.random.random(size = num_points)
+        r2 = np.random.random(size = num_points)
+        reflect = r1 + r2 >= 1.0
+        r1[reflect] = 1 - r1[reflect]
+        r2[reflect] = 1 - r2[reflect]
+
+        points[i] = a + r1[:, np.newaxis] * (b - a) + r2[:, np.newaxis] * (c - a)
+        triangles[i] = obj[idx]
 
     return points, triangles
 
-def farthest_points_normalized(points, faces, num_points):
-    res_points = []
-    res_faces = []
-
-    for obj_points, obj_faces in zip(points, faces):
-        first = np.random.randint(len(obj_points))
-        selected = [first]
-        dists = np.full(shape = len(obj_points), fill_value = np.inf)
-
-        for _ in range(num_points - 1):
-            dists = np.minimum(dists, np.linalg.norm(obj_points - obj_points[selected[-1]][np.newaxis, :], axis = 1))
-            selected.append(np.argmax(dists))
-        
-        res_points.append(obj_points[selected])
-        res_faces.append(obj_faces[selected])
-    
-    res_points = np.array(res_points)
-    res_faces = np.array(res_faces)
+def farthest_points(points, num_points):
+    # indices of the farthest points for a batch of objects with the same number of points
+    batch_idx = np.arange(len(points))
+    selected = np.empty(shape = (len(points), num_points), dtype = int)
+    for i in range(len(points)):
+        selected[i, 0] = np.random.randint(points.shape[1])
+
+    # one contiguous array per coordinate and preallocated buffers that are updated in place
+    coords = np.ascontiguousarray(np.moveaxis(points, 2, 0))
+    dists = np.full(shape = points.shape[:2], fill_value = np.inf)
+    curr_dists = np.empty(shape = points.shape[:2], dtype = points.dtype)
+    diff = np.empty(shape = points.shape[:2], dtype = points.dtype)
+
+    for i in range(1, num_points):
+        last = points[batch_idx, selected[:, i - 1]]
+        # same operations in the same order as np.linalg.norm, so the distances are bitwise equal
+        np.subtract(coords[0], last[:, 0, np.newaxis], out = curr_dists)
+        np.multiply(curr_dists, curr_dists, out = curr_dists)
+        for j in range(1, coords.shape[0]):
+            np.subtract(coords[j], last[:, j, np.newaxis], out = diff)
+            np.multiply(diff, diff, out = diff)
+            np.add(curr_dists, diff, out = curr_dists)
+        np.sqrt(curr_dists, out = curr_dists)
+        np.minimum(dists, curr_dists, out = dists)
+        selected[:, i] = np.argmax(dists, axis = 1)
+
+    return selected
+
+def farthest_points_normalized(points, faces, num_points, batch_size = 64):
+    points = np.asarray(points)
+    faces = np.asarray(faces)
+    res_points = np.empty(shape = (len(points), num_points) + points.shape[2:], dtype = points.dtype)
+    res_faces = np.empty(shape = (len(faces), num_points) + faces.shape[2:], dtype = faces.dtype)
+
+    for start in range(0, len(points), batch_size):
+        end = min(start + batch_size, len(points))
+        selected = farthest_points(points[start:end], num_points)
+        batch_idx = np.arange(end - start)[:, np.newaxis]
+        res_points[start:end] = points[start:end][batch_idx, selected]
+        res_faces[start:end] = faces[start:end][batch_idx, selected]
 
     # normalize the points and faces
     avg = np.average(np.transpose(res_points, axes = (0, 2, 1)), axis = 2)
@@ -15,6 +15,7 @@ from eulerangles import euler2mat
 # Point cloud IO
 import numpy as np
 from plyfile import PlyData, PlyElement
+from numpy.lib.recfunctions import structured_to_unstructured, unstructured_to_structured
 
  
 # ----------------------------------------
@@ -25,17 +26,11 @@ def point_cloud_to_volume_batch(point_clouds, vsize=12, radius=1.0, flatten=True
     """ Input is BxNx3 batch of point cloud
         Output is Bx(vsize^3)
     """
-    vol_list = []
-    for b in range(point_clouds.shape[0]):
-        vol = point_cloud_to_volume(np.squeeze(point_clouds[b,:,:]), vsize, radius)
-        if flatten:
-            vol_list.append(vol.flatten())
-        else:
-            vol_list.append(np.expand_dims(np.expand_dims(vol, -1), 0))
+    vol = voxelize_batch(point_clouds, vsize, radius)
     if flatten:
-        return np.vstack(vol_list)
+        return vol.reshape(vol.shape[0], -1)
     else:
-        return np.concatenate(vol_list, 0)
+        return np.expand_dims(vol, -1)
 
 
 def point_cloud_to_volume(points, vsize, radius=1.0):
@@ -43,12 +38,49 @@ def point_cloud_to_volume(points, vsize, radius=1.0):
         output is vsize*vsize*vsize
         assumes points are in range [-radius, radius]
     """
-    vol = np.zeros((vsize,vsize,vsize))
+    return voxelize_batch(points[np.newaxis], vsize, radius)[0]
+
+
+def voxelize_batch(point_clouds, vsize, radius=1.0, mode='occupancy', sparse=False):
+    """ input is BxNx3 batch of point clouds, in range [-radius, radius].
+        mode is 'occupancy' for 0 or 1 per voxel, 'count' for the number of points per voxel,
+        or 'mean' for the mean of the points in each voxel.
+        output is B*vsize*vsize*vsize, or B*vsize*vsize*vsize*3 for the mean.
+        if sparse, output is (Kx4 indices of (batch, x, y, z) for the K non-empty voxels, their K values),
+        which never allocates the full grid.
+    """
+    point_clouds = np.asarray(point_clouds)
+    batch_size = point_clouds.shape[0]
     voxel = 2*radius/float(vsize)
-    locations = (points + radius)/voxel
-    locations = locations.astype(int)
-    vol[locations[:,0],locations[:,1],locations[:,2]] = 1.0
-    return vol
+    locations = ((point_clouds + radius)/voxel).astype(int)
+    batch_idx = np.repeat(np.arange(batch_size), point_clouds.shape[1])
+    # points at exactly +radius would land one past the last voxel and spill into the next row
+    locations = np.clip(locations.reshape(-1, 3), 0, vsize-1)
+    flat = ((batch_idx*vsize + locations[:,0])*vsize + locations[:,1])*vsize + locations[:,2]
+
+    if sparse:
+        flat, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+        num_voxels = len(flat)
+        indices = np.stack(np.unravel_index(flat, (batch_size, vsize, vsize, vsize)), axis=1)
+    else:
+        inverse = flat
+        num_voxels = batch_size*vsize*vsize*vsize
+        counts = np.bincount(flat, minlength=num_voxels)
+
+    if mode == 'occupancy':
+        values = (counts > 0).astype(float)
+    elif mode == 'count':
+        values = counts
+    elif mode == 'mean':
+        points = point_clouds.reshape(-1, 3)
+        sums = np.stack([np.bincount(inverse, weights=points[:,i], minlength=num_voxels) for i in range(3)], axis=1)
+        values = sums / np.maximum(counts, 1)[:, np.newaxis]
+    else:
+        raise ValueError("Unknown voxelization mode %s!" % mode)
+
+    if sparse:
+        return indices, values
+    return values.reshape((batch_size, vsize, vsize, vsize) + values.shape[1:])
 
 #a = np.zeros((16,1024,3))
 #print point_cloud_to_volume_batch(a, 12, 1.0, False).shape
@@ -59,17 +91,18 @@ def volume_to_point_cloud(vol):
     """
     vsize = vol.shape[0]
     assert(vol.shape[1] == vsize and vol.shape[1] == vsize)
-    points = []
-    for a in range(vsize):
-        for b in range(vsize):
-            for c in range(vsize):
-                if vol[a,b,c] == 1:
-                    points.append(np.array([a,b,c]))
+    points = np.argwhere(vol == 1)
     if len(points) == 0:
         return np.zeros((0,3))
-    points = np.vstack(points)
     return points
 
+
+def volume_to_point_cloud_batch(vols):
+    """ vols is batch of occupancy grids of size B*vsize*vsize*vsize
+        return Kx4 numpy array of (batch, x, y, z) for the occupied voxels, the same indices as the sparse output of voxelize_batch.
+    """
+    return np.argwhere(vols == 1)
+
 # ----------------------------------------
 # Point cloud IO
 # ----------------------------------------
@@ -78,22 +111,125 @@ def read_ply(filename):
     """ read XYZ point cloud from filename PLY file """
     plydata = PlyData.read(filename)
     pc = plydata['vertex'].data
-    pc_array = np.array([[x, y, z] for x,y,z in pc])
+    # a view of the x, y, and z fields of the vertex records when they have the same type
+    pc_array = structured_to_unstructured(pc[['x', 'y', 'z']])
     return pc_array
 
 
 def write_ply(points, filename, text=True):
     """ input: Nx3, write points to filename as PLY format. """
-    points = [(points[i,0], points[i,1], points[i,2]) for i in range(points.shape[0])]
-    vertex = np.array(points, dtype=[('x', 'f4'), ('y', 'f4'),('z', 'f4')])
+    vertex = unstructured_to_structured(np.asarray(points, dtype='f4'), dtype=[('x', 'f4'), ('y', 'f4'),('z', 'f4')])
     el = PlyElement.describe(vertex, 'vertex', comments=['vertices'])
     PlyData([el], text=text).write(filename)
 
 
+def write_ply_batch(point_clouds, filenames, text=False):
+    """ input: BxNx3 and B file names, write each point cloud to its file as PLY format.
+        binary files are written directly from the vertex array with tofile. """
+    for points, filename in zip(point_clouds, filenames):
+        write_ply(points, filename, text=text)
+
+
 # ----------------------------------------
 # Simple Point cloud and Volume Renderers
 # ----------------------------------------
 
+# Gaussian disk kernels, keyed by diameter
+disk_cache = {}
+
+def gaussian_disk(diameter):
+    """ Return the pixel offsets and values of the Gaussian disk, computed once for each diameter. """
+    if diameter not in disk_cache:
+        radius = (diameter-1)/2.0
+        disk = np.zeros((diameter, diameter))
+        for i in range(diameter):
+            for j in range(diameter):
+                if (i - radius) * (i-radius) + (j-radius) * (j-radius) <= radius * radius:
+                    disk[i, j] = np.exp((-(i-radius)**2 - (j-radius)**2)/(radius**2))
+        mask = np.argwhere(disk > 0)
+        disk_cache[diameter] = (mask[:, 0], mask[:, 1], disk[disk > 0])
+    return disk_cache[diameter]
+
+def draw_point_clouds(point_clouds, canvasSize=500, space=200, diameter=25,
+                      rotations=[(0, 0, 0)], switch_xyz=[0,1,2], normalize=False, batch_size=16):
+    """ Render every point cloud from every rotation, splatting into all of the images at once.
+        Input:
+            point_clouds: list of Nx3 numpy arrays (+y is up direction)
+            rotations: list of (xrot, yrot, zrot) angles
+            batch_size: number of point clouds rendered at once
+        Output:
+            gray images as numpy array of size len(point_clouds)xlen(rotations)xcanvasSizexcanvasSize,
+            the same as calling draw_point_cloud for each point cloud and rotation
+    """
+    images = np.zeros((len(point_clouds), len(rotations), canvasSize, canvasSize))
+    dx, dy, dv = gaussian_disk(diameter)
+    offsets = dx * canvasSize + dy
+
+    for start in range(0, len(point_clouds), batch_size):
+        curr_images = images[start:start + batch_size].reshape(-1)
+        bases = []
+        depths = []
+        for b in range(start, min(start + batch_size, len(point_clouds))):
+            if point_clouds[b] is None or point_clouds[b].shape[0] == 0:
+                continue
+            for r, (xrot, yrot, zrot) in enumerate(rotations):
+                points = point_clouds[b][:, switch_xyz]
+                M = euler2mat(zrot, yrot, xrot)
+                points = (np.dot(M, points.transpose())).transpose()
+
+                # Normalize the point cloud
+                # We normalize scale to fit points in a unit sphere
+                if normalize:
+                    centroid = np.mean(points, axis=0)
+                    points -= centroid
+                    furthest_distance = np.max(np.sqrt(np.sum(abs(points)**2,axis=-1)))
+                    points /= furthest_distance
+
+                dist = np.linalg.norm(points, axis = -1)
+                points = points[dist <= 1]
+                if len(points) == 0:
+                    continue
+
+                # Order points by z-buffer, and draw them from back to front
+                zorder = np.argsort(points[:, 2])
+                points = points[zorder, :]
+                points[:, 2] = (points[:, 2] - np.min(points[:, 2])) / (np.max(points[:, 2] - np.min(points[:, 2])))
+                max_depth = np.max(points[:, 2])
+                points = points[::-1]
+
+                xc = np.round(canvasSize/2 + (points[:, 0]*space)).astype(int)
+                yc = np.round(canvasSize/2 + (points[:, 1]*space)).astype(int)
+                image_idx = (b - start) * len(rotations) + r
+                bases.append((image_idx * canvasSize + xc) * canvasSize + yc)
+                depths.append(max_depth - points[:, 2])
+
+        if len(bases) == 0:
+            continue
+
+        # the images with the most points come first, so the images that still have points to draw are always a prefix
+        counts = np.array([len(base) for base in bases])
+        order = np.argsort(-counts, kind='stable')
+        counts = counts[order]
+        padded_bases = np.zeros((len(bases), counts[0]), dtype=int)
+        padded_depths = np.zeros((len(bases), counts[0]))
+        for i, j in enumerate(order):
+            padded_bases[i, :counts[i]] = bases[j]
+            padded_depths[i, :counts[i]] = depths[j]
+
+        # the i-th point of every image is drawn at once, which blends each pixel in the same order as drawing the points one at a time
+        active = len(bases)
+        for i in range(counts[0]):
+            while counts[active - 1] <= i:
+                active -= 1
+            idx = padded_bases[:active, i, np.newaxis] + offsets
+            curr_images[idx] = curr_images[idx] * 0.7 + dv * padded_depths[:active, i, np.newaxis] * 0.3
+
+    for b in range(len(point_clouds)):
+        for r in range(len(rotations)):
+            if np.any(images[b, r]):
+                images[b, r] = images[b, r] / np.max(images[b, r])
+    return images
+
 def draw_point_cloud(input_points, canvasSize=500, space=200, diameter=25,
                      xrot=0, yrot=0, zrot=0, switch_xyz=[0,1,2], normalize=False):
     """ Render point cloud to image with alpha channel.
@@ -102,74 +238,26 @@ def draw_point_cloud(input_points, canvasSize=500, space=200, diameter=25,
         Output:
             gray image as numpy array of size canvasSizexcanvasSize
     """
-    image = np.zeros((canvasSize, canvasSize))
-    if input_points is None or input_points.shape[0] == 0:
-        return image
-
-    points = input_points[:, switch_xyz]
-    M = euler2mat(zrot, yrot, xrot)
-    points = (np.dot(M, points.transpose())).transpose()
-
-    # Normalize the point cloud
-    # We normalize scale to fit points in a unit sphere
-    if normalize:
-        centroid = np.mean(points, axis=0)
-        points -= centroid
-        furthest_distance = np.max(np.sqrt(np.sum(abs(points)**2,axis=-1)))
-        points /= furthest_distance
-    
-    dist = np.linalg.norm(points, axis = -1)
-    points = points[dist <= 1]
-    if len(points) == 0:
-        return image
-
-    # Pre-compute the Gaussian disk
-    radius = (diameter-1)/2.0
-    disk = np.zeros((diameter, diameter))
-    for i in range(diameter):
-        for j in range(diameter):
-            if (i - radius) * (i-radius) + (j-radius) * (j-radius) <= radius * radius:
-                disk[i, j] = np.exp((-(i-radius)**2 - (j-radius)**2)/(radius**2))
-    mask = np.argwhere(disk > 0)
-    dx = mask[:, 0]
-    dy = mask[:, 1]
-    dv = disk[disk > 0]
-    
-    # Order points by z-buffer
-    zorder = np.argsort(points[:, 2])
-    points = points[zorder, :]
-    points[:, 2] = (points[:, 2] - np.min(points[:, 2])) / (np.max(points[:, 2] - np.min(points[:, 2])))
-    max_depth = np.max(points[:, 2])
-       
-    for i in range(points.shape[0]):
-        j = points.shape[0] - i - 1
-        x = points[j, 0]
-        y = points[j, 1]
-        xc = canvasSize/2 + (x*space)
-        yc = canvasSize/2 + (y*space)
-        xc = int(np.round(xc))
-        yc = int(np.round(yc))
-        
-        px = dx + xc
-        py = dy + yc
-        
-        image[px, py] = image[px, py] * 0.7 + dv * (max_depth - points[j, 2]) * 0.3
-    
-    image = image / np.max(image)
-    return image
+    return draw_point_clouds([input_points], canvasSize, space, diameter, [(xrot, yrot, zrot)], switch_xyz, normalize)[0, 0]
+
+# +y is up direction
+# xrot is azimuth
+# yrot is in-plane
+# zrot is elevation
+three_view_rotations = [(45/180.0*np.pi, 0/180.0*np.pi, 110/180.0*np.pi),
+                        (135/180.0*np.pi, 0/180.0*np.pi, 70/180.0*np.pi),
+                        (90/180.0*np.pi, 0/180.0*np.pi, 180.0/180.0*np.pi)]
 
 def point_cloud_three_views(points):
     """ input points Nx3 numpy array (+y is up direction).
         return an numpy array gray image of size 500x1500. """ 
-    # +y is up direction
-    # xrot is azimuth
-    # yrot is in-plane
-    # zrot is elevation
-    img1 = draw_point_cloud(points, zrot=110/180.0*np.pi, xrot=45/180.0*np.pi, yrot=0/180.0*np.pi)
-    img2 = draw_point_cloud(points, zrot=70/180.0*np.pi, xrot=135/180.0*np.pi, yrot=0/180.0*np.pi)
-    img3 = draw_point_cloud(points, zrot=180.0/180.0*np.pi, xrot=90/180.0*np.pi, yrot=0/180.0*np.pi)
-    image_large = np.concatenate([img1, img2, img3], 1)
-    return image_large
+    return point_cloud_three_views_batch([points])[0]
+
+def point_cloud_three_views_batch(point_clouds):
+    """ input list of Nx3 numpy arrays (+y is up direction).
+        return numpy array of gray images of size len(point_clouds)x500x1500. """
+    images = draw_point_clouds(point_clouds, rotations=three_view_rotations)
+    return np.concatenate([images[:, 0], images[:, 1], images[:, 2]], 2)
 
 
 from PIL import Image
@@ -613,11 +613,39 @@ class PlyElement(object):
         Load a PLY element from an ASCII-format PLY file.  The element
         may contain list properties.
 
+        '''
+        lines = list(_islice(iter(stream.readline, b''), self.count))
+
+        if not self._have_list and len(lines) == self.count:
+            # Without list properties, every line has the same fields,
+            # so all of the lines can be split and converted at once.
+            fields = b' '.join(lines).split()
+            if len(fields) == self.count * len(self.properties):
+                fields = _np.array(fields).reshape(self.count, -1)
+                data = _np.empty(self.count, dtype=self.dtype())
+                try:
+                    for (i, prop) in enumerate(self.properties):
+                        data[prop.name] = fields[:, i].astype(prop.dtype())
+                except ValueError:
+                    pass
+                else:
+                    self._data = data
+                    return
+
+        # Fall back to parsing line by line, which also finds the
+        # exact location of any malformed input.
+        self._read_txt_lines(lines)
+
+    def _read_txt_lines(self, lines):
+        '''
+        Load a PLY element from the lines of an ASCII-format PLY file,
+        one line at a time.
+
         '''
         self._data = _np.empty(self.count, dtype=self.dtype())
 
         k = 0
-        for line in _islice(iter(stream.readline, b''), self.count):
+        for line in lines:
             fields = iter(line.strip().split())
             for prop in self.properties:
                 try:
@@ -646,6 +674,18 @@ class PlyElement(object):
         contain list properties.
 
         '''
+        if not self._have_list:
+            # Without list properties, the rows can be formatted in
+            # large chunks instead of one at a time.
+            columns = _np.stack([self.data[prop.name].astype(_np.float64)
+                                 for prop in self.properties], axis=1)
+            row = ' '.join(['%.18g'] * len(self.properties)) + '\r\n'
+            for start in _range(0, len(columns), 4096):
+                chunk = columns[start:start + 4096]
+                stream.write(((row * len(chunk)) %
+                              tuple(chunk.ravel().tolist())).encode('latin1'))
+            return
+
         for rec in self.data:
             fields = []
             for prop in self.properties:
@@ -580,7 +580,8 @@ def dropout(inputs,
     tensor variable
   """
   with tf.variable_scope(scope) as sc:
-    outputs = tf.cond(is_training,
-                      lambda: tf.nn.dropout(inputs, keep_prob, noise_shape),
-                      lambda: inputs)
+    # a constant is_training picks its branch when the graph is built, so exported graphs have no cond
+    outputs = tf.contrib.framework.smart_cond(is_training,
+                                              lambda: tf.nn.dropout(inputs, keep_prob, noise_shape),
+                                              lambda: inputs)
     return outputs
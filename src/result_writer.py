@@ -0,0 +1,77 @@
+import numpy as np
+import zipfile
+import shutil
+import glob
+import os
+
+def shard_dir(path):
+    return path + ".shards"
+
+def shard_paths(path):
+    # maps each array name to its shard files, in the order that they were written
+    res = {}
+    for shard_path in sorted(glob.glob(os.path.join(shard_dir(path), "*.npy"))):
+        name = os.path.basename(shard_path)[:-len(".npy")].split("_", 1)[1]
+        res.setdefault(name, []).append(shard_path)
+    return res
+
+class ResultWriter(object):
+    # appends arrays to uncompressed shards as results come in, and merges them into one compressed npz file when closed
+    def __init__(self, path, resume = False, empty = None):
+        self.path = path
+        self.empty = empty
+        self.num_shards = 0
+        if os.path.exists(shard_dir(path)) and not resume:
+            shutil.rmtree(shard_dir(path))
+        if not os.path.exists(shard_dir(path)):
+            os.makedirs(shard_dir(path))
+
+    def append(self, shard = None, **arrays):
+        # shards are merged in the order of their names, and writing a shard with the same name replaces it
+        if shard is None:
+            shard = "%08d" % self.num_shards
+        for name, arr in arrays.items():
+            shard_path = os.path.join(shard_dir(self.path), "%s_%s.npy" % (shard, name))
+            # write to a temporary file first so a crash never leaves a partial shard
+            with open(shard_path + ".tmp", "wb") as file:
+                np.save(file, np.asarray(arr))
+            os.rename(shard_path + ".tmp", shard_path)
+        self.num_shards += 1
+
+    def close(self):
+        merge_shards(self.path, empty = self.empty)
+
+def merge_shards(path, empty = None):
+    # streams the shards into the same format as np.savez_compressed, without loading all of them at once
+    shards = shard_paths(path)
+    # empty maps array names to zero length arrays, which are written for the arrays that nothing was appended to
+    if empty is not None:
+        if not os.path.exists(shard_dir(path)):
+            os.makedirs(shard_dir(path))
+        for name, arr in empty.items():
+            if name not in shards:
+                shard_path = os.path.join(shard_dir(path), "empty_%s.npy" % name)
+                np.save(shard_path, np.asarray(arr))
+                shards[name] = [shard_path]
+
+    with zipfile.ZipFile(path + ".tmp", "w", compression = zipfile.ZIP_DEFLATED, allowZip64 = True) as zip_file:
+        for name, paths in shards.items():
+            arrays = [np.load(shard_path, mmap_mode = "r") for shard_path in paths]
+            header = {
+                "descr": np.lib.format.dtype_to_descr(arrays[0].dtype),
+                "fortran_order": False,
+                "shape": (sum(len(arr) for arr in arrays),) + arrays[0].shape[1:]
+            }
+            with zip_file.open(name + ".npy", "w", force_zip64 = True) as file:
+                np.lib.format.write_array_header_1_0(file, header)
+                for arr in arrays:
+                    file.write(np.ascontiguousarray(arr).tobytes())
+
+    os.rename(path + ".tmp", path)
+    shutil.rmtree(shard_dir(path))
+
+def iterate_shards(path):
+    # yields a dict of arrays for each shard of a run that has not finished
+    shards = shard_paths(path)
+    for i in range(min(len(paths) for paths in shards.values()) if shards else 0):
+        yield {name: np.load(paths[i]) for name, paths in shards.items()}
@@ -1,9 +1,66 @@
 import point_cloud_utils
 import numpy as np
+import argparse
+import glob
+import hashlib
+import multiprocessing
+import os
 
-class_names = [line.rstrip() for line in open("shape_names.txt")]
-objects, labels = point_cloud_utils.read_off_files("objects/*/test/*.off", class_names)
-points, faces = point_cloud_utils.sample_points(objects, 10000)
-points, faces = point_cloud_utils.farthest_points_normalized(points, faces, 2048)
+parser = argparse.ArgumentParser(description = "Samples point clouds from the surfaces of OFF meshes.", formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--data", default = "objects/*/test/*.off", help = "Glob path of the OFF files to sample from.")
+parser.add_argument("--class-names", default = "shape_names.txt", help = "Text file containing a list of class names.")
+parser.add_argument("--output", default = "point_clouds.npz", help = "Output Numpy file.")
+parser.add_argument("--num-samples", type = int, default = 10000, help = "Number of points to sample from each surface before farthest point sampling.")
+parser.add_argument("--num-points", type = int, default = 2048, help = "Number of points to keep for each object.")
+parser.add_argument("--workers", type = int, default = multiprocessing.cpu_count(), help = "Number of worker processes.")
+parser.add_argument("--seed", type = int, default = 0, help = "Random seed. Each object uses the seed plus its index, so the results do not depend on the number of workers.")
+args = parser.parse_args()
 
-np.savez_compressed("point_clouds.npz", points = points, faces = faces, labels = labels)
\ No newline at end of file
+class_names = [line.rstrip() for line in open(args.class_names)]
+label_names = {class_names[i]: i for i in range(len(class_names))}
+
+def object_id(path):
+    # from the file name, like airplane_0627, so the id does not depend on where the data is or which other objects were sampled
+    name = os.path.splitext(os.path.basename(path))[0]
+    return int(hashlib.sha1(name.encode()).hexdigest()[:15], 16)
+
+def sample_object(job):
+    idx, path = job
+    np.random.seed(args.seed + idx)
+
+    faces, label = point_cloud_utils.read_off_object(path, label_names)
+    points, faces = point_cloud_utils.sample_points([faces], args.num_samples)
+    points, faces = point_cloud_utils.farthest_points_normalized(points, faces, args.num_points)
+
+    return idx, points[0], faces[0], label
+
+if __name__ == "__main__":
+    print(args)
+
+    paths = sorted(glob.glob(args.data)) # sorted so each object always gets the same index
+
+    ids = np.array([object_id(path) for path in paths], dtype = np.int64)
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError("Object file names must be unique to give each object a stable id!")
+
+    points = np.empty(shape = (len(paths), args.num_points, 3))
+    faces = np.empty(shape = (len(paths), args.num_points, 3, 3))
+    labels = np.empty(shape = len(paths), dtype = int)
+
+    def store(res):
+        idx, curr_points, curr_faces, curr_label = res
+        points[idx] = curr_points
+        faces[idx] = curr_faces
+        labels[idx] = curr_label
+
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        for res in pool.imap_unordered(sample_object, enumerate(paths), chunksize = 4):
+            store(res)
+        pool.close()
+        pool.join()
+    else:
+        for res in map(sample_object, enumerate(paths)):
+            store(res)
+
+    np.savez_compressed(args.output, points = points, faces = faces, labels = labels, ids = ids)
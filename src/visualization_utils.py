@@ -1,34 +1,130 @@
 import numpy as np
+import result_writer
+import collections
+import hashlib
+import os
 
-def read_npz_files(paths):
+def iterate_result_shards(path):
+    return result_writer.iterate_shards(path)
+
+def read_results(path):
+    if os.path.exists(path):
+        return np.load(path)
+    # the run did not finish, so read the shards that were written so far
+    shards = list(iterate_result_shards(path))
+    if len(shards) == 0:
+        raise ValueError("Results %s do not exist!" % path)
+    return {k: np.concatenate([shard[k] for shard in shards]) for k in shards[0]}
+
+class ArrayCache(object):
+    # keeps the most recently used arrays, dropping the least recently used ones once they take more than max_bytes
+    def __init__(self, max_bytes = 2 ** 30):
+        self.max_bytes = max_bytes
+        self.arrays = collections.OrderedDict()
+        self.num_bytes = 0
+
+    def get(self, key, load_fn):
+        if key in self.arrays:
+            self.arrays.move_to_end(key)
+            return self.arrays[key]
+
+        arr = load_fn()
+        self.arrays[key] = arr
+        self.num_bytes += arr.nbytes
+        while self.num_bytes > self.max_bytes and len(self.arrays) > 1:
+            _, evicted = self.arrays.popitem(last = False)
+            self.num_bytes -= evicted.nbytes
+        return arr
+
+# shared by every results file, so the memory bound covers all of them
+array_cache = ArrayCache()
+
+class LazyResults(object):
+    # indexing an npz file decompresses the whole array every time, so each array is decompressed once and then cached
+    def __init__(self, path, cache = None):
+        self.path = path
+        self.cache = array_cache if cache is None else cache
+        self.file = read_results(path)
+
+    def keys(self):
+        return list(self.file.keys())
+
+    def __contains__(self, k):
+        return k in self.file
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, k):
+        return self.cache.get((self.path, k), lambda: self.file[k])
+
+def read_npz_files(paths, cache = None):
     files = []
     for path in paths:
-        files.append(np.load(path))
+        files.append(LazyResults(path, cache = cache))
     return files
 
+def hash_objects(x):
+    # float32 bytes, so results that stored the same objects as float64 still match
+    return np.array([hashlib.sha1(np.ascontiguousarray(curr_x, dtype = np.float32).tobytes()).digest() for curr_x in x], dtype = "S20")
+
+def object_hashes(file):
+    # the hashes of a finished results file are saved next to it, so they are only computed once
+    path = getattr(file, "path", None)
+    if path is None or not os.path.exists(path):
+        return hash_objects(file["x_original"])
+
+    index_path = path + ".hashes.npy"
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        return np.load(index_path)
+
+    hashes = hash_objects(file["x_original"])
+    with open(index_path + ".tmp", "wb") as f:
+        np.save(f, hashes)
+    os.rename(index_path + ".tmp", index_path)
+    return hashes
+
+def object_keys(file, use_ids = True):
+    # the stable ids from sample_point_clouds.py when the results have them, and content hashes for older results
+    if use_ids and "ids" in file:
+        return file["ids"]
+    return object_hashes(file)
+
 def files_to_dicts(files):
+    # ids never match content hashes, so every file is keyed by its content hashes unless all of them have ids
+    use_ids = all("ids" in file for file in files)
     dicts = []
     for file in files:
-        dict = {}
-        for i, x in enumerate(file["x_original"]):
-            dict[x.tobytes()] = i
-        dicts.append(dict)
+        dicts.append({k: i for i, k in enumerate(object_keys(file, use_ids = use_ids))})
     return dicts
 
-def get_intersection(data):
-    keys = data[0].keys()
-    for i in range(1, len(data)):
-        keys &= data[i].keys()
-    return keys
+def join_index(paths, index_path = None):
+    # finds the objects that are in every results file and their rows in each file, so rows[i][j] is the row of keys[j] in paths[i]
+    # the index is saved to index_path, and reused while it is newer than every results file
+    cacheable = index_path is not None and all(os.path.exists(path) for path in paths)
+    if cacheable and os.path.exists(index_path) and all(os.path.getmtime(index_path) >= os.path.getmtime(path) for path in paths):
+        with np.load(index_path) as file:
+            if list(file["paths"]) == list(paths):
+                return file["keys"], file["rows"]
+
+    dicts = files_to_dicts(read_npz_files(paths))
+    # a single pass over the first file, in its order
+    keys = [k for k in dicts[0] if all(k in curr_dict for curr_dict in dicts[1:])]
+    rows = np.array([[curr_dict[k] for k in keys] for curr_dict in dicts], dtype = int).reshape(len(dicts), len(keys))
+    keys = np.array(keys)
+
+    if cacheable:
+        with open(index_path + ".tmp", "wb") as f:
+            np.savez(f, paths = np.array(paths), keys = keys, rows = rows)
+        os.rename(index_path + ".tmp", index_path)
+    return keys, rows
 
-def get_common_labels(files, data, common, class_names):
-    res = []
-    for key in common:
-        res.append(class_names[files[0]["labels"][data[0][key]]])
-    return res
+def get_common_labels(files, rows, class_names):
+    # rows are from join_index, for the same files
+    return [class_names[label] for label in files[0]["labels"][rows[0]]]
 
-def get_object(files, data, key):
+def get_object(files, rows, idx):
     dicts = []
-    for file, curr_data in zip(files, data):
-        dicts.append({k: file[k][curr_data[key]] for k in file.keys()})
+    for file, curr_rows in zip(files, rows):
+        dicts.append({k: file[k][curr_rows[idx]] for k in file.keys()})
     return dicts
\ No newline at end of file
@@ -43,29 +43,28 @@ show_title = False
 show_axis_numbers = False
 class_names = [line.rstrip() for line in open("shape_names_unique.txt")]
 
-pointnet_files = visualization_utils.read_npz_files(pointnet_paths)
+paths = pointnet_paths + pointnet2_paths if show_both else pointnet_paths
+# the objects in every file and their rows are saved next to the results, so they are only found once
+keys, rows = visualization_utils.join_index(paths, os.path.join(os.path.commonpath([os.path.dirname(path) for path in paths]), "join_index.npz"))
+print("Number of objects in common: %d" % len(keys))
+
+files = visualization_utils.read_npz_files(paths)
+pointnet_files = files[:len(pointnet_paths)]
+pointnet_rows = rows[:len(pointnet_paths)]
 if show_both:
-    pointnet2_files = visualization_utils.read_npz_files(pointnet2_paths)
-pointnet_data = visualization_utils.files_to_dicts(pointnet_files)
-if show_both:
-    pointnet2_data = visualization_utils.files_to_dicts(pointnet2_files)
-
-common = visualization_utils.get_intersection(pointnet_data)
-if show_both:
-    common = common & visualization_utils.get_intersection(pointnet2_data)
-common = list(common)
-print("Number of objects in common: %d" % len(common))
+    pointnet2_files = files[len(pointnet_paths):]
+    pointnet2_rows = rows[len(pointnet_paths):]
 
-pointnet_labels = visualization_utils.get_common_labels(pointnet_files, pointnet_data, common, class_names)
+pointnet_labels = visualization_utils.get_common_labels(pointnet_files, pointnet_rows, class_names)
 if show_both:
-    pointnet2_labels = visualization_utils.get_common_labels(pointnet2_files, pointnet2_data, common, class_names)
+    pointnet2_labels = visualization_utils.get_common_labels(pointnet2_files, pointnet2_rows, class_names)
     assert pointnet_labels == pointnet2_labels
 print("Common object labels: %s" % pointnet_labels)
 
 chosen_idx = pointnet_labels.index(class_str)
-pointnet_object = visualization_utils.get_object(pointnet_files, pointnet_data, common[chosen_idx])
+pointnet_object = visualization_utils.get_object(pointnet_files, pointnet_rows, chosen_idx)
 if show_both:
-    pointnet2_object = visualization_utils.get_object(pointnet2_files, pointnet2_data, common[chosen_idx])
+    pointnet2_object = visualization_utils.get_object(pointnet2_files, pointnet2_rows, chosen_idx)
 print("Chosen label: %s" % class_names[pointnet_object[0]["labels"]])
 
 os.makedirs("point_clouds/images/%s" % class_str, exist_ok = True)